@@ -0,0 +1,306 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from histogram import (
+    HistogramDatabase,
+    compute_distances,
+    load_histogram_database,
+    select_top_k,
+)
+from histogram_store import STORE_EXTENSION, is_store_path
+from query_cache import LoaderCache
+
+
+# IVF (inverted file) index over a histogram store. Vectors live in the
+# Hellinger embedding sqrt(p / sum(p)): unit-norm vectors for which L2 order
+# matches Bhattacharyya order, and a close proxy for chi-square. A k-means
+# coarse quantizer splits the store into ``nlist`` lists; a query only scores
+# the images of its ``nprobe`` closest lists, then ranks them exactly.
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 20
+# Training sample per list; caps k-means cost on large stores
+TRAIN_POINTS_PER_LIST = 256
+# Retrain the quantizer once the store grew this much since training
+RETRAIN_GROWTH = 4.0
+
+_CHUNK_ROWS = 4096
+
+
+def ivf_path(store_path: str) -> str:
+    base = (
+        store_path[: -len(STORE_EXTENSION)] if is_store_path(store_path) else store_path
+    )
+    return base + ".ivf.npz"
+
+
+def default_nlist(n: int) -> int:
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def _hellinger(q_hist: np.ndarray) -> np.ndarray:
+    p = np.clip(np.asarray(q_hist, dtype=np.float32), 0, None)
+    s = p.sum()
+    if s > 0:
+        p /= s
+    return np.sqrt(p)
+
+
+def _nearest_centroids(x: np.ndarray, centroids: np.ndarray, n: int = 1) -> np.ndarray:
+    """Indices of the ``n`` closest centroids for every row of ``x`` (``(N, n)``)."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty((x.shape[0], n), dtype=np.int64)
+    for start in range(0, x.shape[0], _CHUNK_ROWS):
+        # ||x||^2 is constant per row and does not change the order
+        d = c_sq - 2.0 * (x[start : start + _CHUNK_ROWS] @ centroids.T)
+        if n >= centroids.shape[0]:
+            out[start : start + _CHUNK_ROWS] = np.argsort(d, axis=1)
+        else:
+            part = np.argpartition(d, n - 1, axis=1)[:, :n]
+            ranks = np.take_along_axis(d, part, axis=1).argsort(axis=1)
+            out[start : start + _CHUNK_ROWS] = np.take_along_axis(part, ranks, axis=1)
+    return out
+
+
+def _kmeans(x: np.ndarray, k: int, niter: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].astype(np.float32)
+    for _ in range(niter):
+        assign = _nearest_centroids(x, centroids)[:, 0]
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Re-seed empty lists on random training points
+            centroids[empty] = x[rng.choice(x.shape[0], empty.size, replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """Coarse k-means quantizer plus one inverted list of filenames per centroid."""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        filenames: List[str],
+        assignments: np.ndarray,
+        trained_size: int,
+    ) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.filenames = list(filenames)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.trained_size = trained_size
+        # Inverted lists in row space of the database bound by ``bind``
+        self._bound: Optional[Tuple[str, int]] = None
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int64)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(
+        cls,
+        db: HistogramDatabase,
+        nlist: Optional[int] = None,
+        niter: int = KMEANS_ITERATIONS,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        if len(db) == 0:
+            raise ValueError("Cannot train an IVF index on an empty store")
+        nlist = min(len(db), nlist or default_nlist(len(db)))
+        vectors = db.sqrt_probabilities
+        rng = np.random.default_rng(seed)
+        n_train = min(len(db), nlist * TRAIN_POINTS_PER_LIST)
+        sample = np.sort(rng.choice(len(db), n_train, replace=False))
+        centroids = _kmeans(np.asarray(vectors[sample]), nlist, niter, seed)
+        assignments = _nearest_centroids(vectors, centroids)[:, 0]
+        return cls(centroids, db.filenames.tolist(), assignments, len(db))
+
+    def add(self, filenames: List[str], vectors: np.ndarray) -> None:
+        """Insert new images given their Hellinger vectors (see ``_hellinger``)."""
+        if not filenames:
+            return
+        assign = _nearest_centroids(
+            np.asarray(vectors, dtype=np.float32), self.centroids
+        )
+        self.filenames.extend(filenames)
+        self.assignments = np.concatenate(
+            [self.assignments, assign[:, 0].astype(np.int32)]
+        )
+        self._bound = None
+
+    def remove(self, filenames: List[str]) -> None:
+        drop = set(filenames)
+        keep = [i for i, f in enumerate(self.filenames) if f not in drop]
+        self.filenames = [self.filenames[i] for i in keep]
+        self.assignments = self.assignments[keep]
+        self._bound = None
+
+    def sync(self, db: HistogramDatabase, changed: Optional[List[str]] = None) -> bool:
+        """Add images new to ``db`` and drop the ones it no longer has.
+
+        Names alone cannot tell that an image was modified: the files listed in
+        ``changed`` are dropped and added again with their current rows.
+        """
+        known = set(self.filenames)
+        kept = known.intersection(db.filenames.tolist()).difference(changed or ())
+        removed = known - kept
+        added_rows = [i for i, f in enumerate(db.filenames) if f not in kept]
+        if removed:
+            self.remove(list(removed))
+        if added_rows:
+            self.add(
+                db.filenames[added_rows].tolist(), db.sqrt_probabilities[added_rows]
+            )
+        return bool(removed or added_rows)
+
+    def bind(self, db: HistogramDatabase) -> None:
+        """Lay the inverted lists out as row indices of ``db``."""
+        if self._bound == (db.path, db.mtime_ns):
+            return
+        self.sync(db)
+        row_of: Dict[str, int] = {f: i for i, f in enumerate(db.filenames)}
+        rows = np.fromiter(
+            (row_of[f] for f in self.filenames),
+            dtype=np.int64,
+            count=len(self.filenames),
+        )
+        order = np.argsort(self.assignments, kind="stable")
+        self._rows = rows[order]
+        counts = np.bincount(self.assignments, minlength=self.nlist)
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._bound = (db.path, db.mtime_ns)
+
+    def candidates(
+        self, q_hist: np.ndarray, nprobe: int = DEFAULT_NPROBE
+    ) -> np.ndarray:
+        """Sorted database rows stored in the ``nprobe`` lists closest to ``q_hist``."""
+        if self._bound is None:
+            raise ValueError("IVF index is not bound to a database; call bind(db)")
+        nprobe = max(1, min(nprobe, self.nlist))
+        q = _hellinger(q_hist)[None, :]
+        lists = _nearest_centroids(q, self.centroids, nprobe)[0]
+        parts = [self._rows[self._offsets[i] : self._offsets[i + 1]] for i in lists]
+        return np.sort(np.concatenate(parts))
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                filenames=np.asarray(self.filenames, dtype=str),
+                assignments=self.assignments,
+                trained_size=np.asarray(self.trained_size),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"IVF index not found: {path} (build it with ann_index.py)"
+            )
+        with np.load(path) as data:
+            return cls(
+                data["centroids"],
+                data["filenames"].tolist(),
+                data["assignments"],
+                int(data["trained_size"]),
+            )
+
+
+# Loaded IVF indexes, keyed by path and versioned by mtime
+_ivf_cache = LoaderCache()
+
+
+def load_ivf_index(db: HistogramDatabase) -> IVFIndex:
+    """IVF index stored next to ``db``'s store, bound to ``db``."""
+    path = ivf_path(db.path)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        _ivf_cache.discard(path)
+        raise FileNotFoundError(
+            f"IVF index not found: {path} (build it with ann_index.py)"
+        )
+    index = _ivf_cache.get(path, mtime_ns, lambda: IVFIndex.load(path))
+    index.bind(db)
+    return index
+
+
+def update_ivf_index(
+    store_path: str,
+    color_space: str,
+    nlist: Optional[int] = None,
+    changed: Optional[List[str]] = None,
+) -> IVFIndex:
+    """Create the IVF index of a store, or bring an existing one up to date.
+
+    New images are inserted into their closest list and deleted ones dropped;
+    images whose rows were recomputed must be listed in ``changed`` to be
+    reassigned. The quantizer is retrained only when the store outgrew it.
+    """
+    db = load_histogram_database(store_path, color_space)
+    path = ivf_path(store_path)
+    index = None
+    if os.path.isfile(path):
+        index = IVFIndex.load(path)
+        if len(db) > RETRAIN_GROWTH * index.trained_size or (
+            nlist is not None and nlist != index.nlist
+        ):
+            index = None
+        else:
+            index.sync(db, changed)
+    if index is None:
+        index = IVFIndex.train(db, nlist=nlist)
+    index.save(path)
+    return index
+
+
+def measure_recall(
+    db: HistogramDatabase,
+    index: IVFIndex,
+    metric: str = "bhattacharyya",
+    normalize: bool = True,
+    top_k: int = 10,
+    nprobe: int = DEFAULT_NPROBE,
+    n_queries: int = 100,
+    seed: int = 0,
+) -> float:
+    """Mean recall@top_k of the IVF search against the exact scan.
+
+    Queries are rows sampled from the store itself.
+    """
+    index.bind(db)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(db), min(n_queries, len(db)), replace=False)
+    hits = 0
+    total = 0
+    for qi in queries:
+        q = np.asarray(db.normalized[qi] if normalize else db.matrix[qi])
+        exact = select_top_k(compute_distances(q, db, metric, normalize), top_k)
+        rows = index.candidates(q, nprobe)
+        approx = rows[
+            select_top_k(compute_distances(q, db, metric, normalize, rows), top_k)
+        ]
+        hits += len(np.intersect1d(exact, approx))
+        total += len(exact)
+    return hits / total if total else 1.0
+
+
+if __name__ == "__main__":
+    for store, space in (("rgb_dictionary.npy", "rgb"), ("hsv_dictionary.npy", "hsv")):
+        ivf = update_ivf_index(store, space)
+        db = load_histogram_database(store, space)
+        print(f"[ann_index] {ivf_path(store)}: {ivf.nlist} list(s), {len(db)} image(s)")
+        for nprobe in (1, 2, 4, DEFAULT_NPROBE):
+            recall = measure_recall(db, ivf, top_k=5, nprobe=nprobe)
+            print(f"[ann_index]   nprobe={nprobe}: recall@5 = {recall:.3f}")
@@ -0,0 +1,526 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Reproducible performance benchmarks. Synthetic image collections and keyword
+# stores are generated from a seed (and kept in ``--workdir`` for later runs),
+# then every case runs in a fresh process so its peak RSS is its own. Results
+# are written as JSON; ``compare`` flags cases whose p50 latency grew or whose
+# throughput dropped by more than a threshold against a baseline file.
+BENCHMARK_FORMAT = "image-search-benchmark"
+BENCHMARK_VERSION = 1
+DEFAULT_WORKDIR = ".benchmark"
+DEFAULT_SIZES: Tuple[int, ...] = (1000,)
+DEFAULT_IMAGE_SIZE: Tuple[int, int] = (160, 120)
+DEFAULT_QUERIES = 50
+DEFAULT_VOCABULARY = 2000
+DEFAULT_THRESHOLD = 0.10
+METRICS: Tuple[str, ...] = ("bhattacharyya", "chi2", "l2")
+
+Case = Dict[str, Any]
+Result = Dict[str, Any]
+
+
+def _write_image(path: str, rng: np.random.Generator, size: Tuple[int, int]) -> None:
+    """A few random colored rectangles over a random gradient."""
+    w, h = size
+    base = rng.integers(0, 256, size=(2, 3))
+    t = np.linspace(0.0, 1.0, w, dtype=np.float32)[None, :, None]
+    img = np.broadcast_to(base[0] + (base[1] - base[0]) * t, (h, w, 3)).copy()
+    for _ in range(int(rng.integers(2, 6))):
+        x0, x1 = np.sort(rng.integers(0, w, size=2))
+        y0, y1 = np.sort(rng.integers(0, h, size=2))
+        img[y0 : y1 + 1, x0 : x1 + 1] = rng.integers(0, 256, size=3)
+    img += rng.normal(0.0, 8.0, size=img.shape)
+    cv.imwrite(path, np.clip(img, 0, 255).astype(np.uint8))
+
+
+def generate_images(
+    out_dir: str,
+    count: int,
+    size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+    seed: int = 0,
+    prefix: str = "synthetic",
+) -> List[str]:
+    """Write ``count`` deterministic JPEG images into ``out_dir``; returns their names."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(count):
+        name = f"{prefix}_{i:06d}.jpg"
+        _write_image(os.path.join(out_dir, name), rng, size)
+        names.append(name)
+    return names
+
+
+def generate_keywords(
+    db_path: str,
+    filenames: Sequence[str],
+    vocabulary: int = DEFAULT_VOCABULARY,
+    seed: int = 0,
+) -> List[str]:
+    """Fill a keyword store with 2-6 Zipf-distributed terms per image.
+
+    Returns the vocabulary, most frequent term first.
+    """
+    from keyword_store import KeywordStore
+
+    rng = np.random.default_rng(seed)
+    terms = [f"kw{i:05d}" for i in range(vocabulary)]
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    dictionnaire: Dict[str, Dict[str, float]] = {}
+    for fname in filenames:
+        count = int(rng.integers(2, 7))
+        picked = rng.choice(vocabulary, size=count, replace=False, p=weights)
+        scores = np.round(rng.uniform(0.3, 1.0, size=count), 2)
+        dictionnaire[fname] = {
+            terms[t]: float(s)
+            for t, s in sorted(zip(picked, scores), key=lambda x: -x[1])
+        }
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    with KeywordStore(db_path) as store:
+        store.import_dictionary(dictionnaire)
+    return terms
+
+
+def keyword_queries(terms: Sequence[str], count: int, seed: int = 0) -> List[str]:
+    """Single-term, AND and OR (``+``) queries over the more frequent terms."""
+    rng = np.random.default_rng(seed)
+    pool = list(terms[: max(1, len(terms) // 10)])
+    queries = []
+    for i in range(count):
+        words = list(rng.choice(pool, size=min(len(pool), 1 + i % 3), replace=False))
+        queries.append(" + ".join(words) if i % 3 == 2 else " ".join(words))
+    return queries
+
+
+def prepare_dataset(
+    workdir: str,
+    size: int,
+    image_size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+    queries: int = DEFAULT_QUERIES,
+    vocabulary: int = DEFAULT_VOCABULARY,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Generate (or reuse) the collection, query images, keyword store and stores.
+
+    A dataset is reused when its manifest records the same parameters.
+    """
+    from indexer import build_index
+
+    settings = {
+        "size": size,
+        "image_size": list(image_size),
+        "queries": queries,
+        "vocabulary": vocabulary,
+        "seed": seed,
+    }
+    root = os.path.join(workdir, f"n{size}_s{seed}")
+    manifest_path = os.path.join(root, "manifest.json")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["settings"] == settings:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    logger.info("Generating dataset of %d image(s) in %s", size, root)
+    images_dir = os.path.join(root, "images")
+    queries_dir = os.path.join(root, "queries")
+    for d in (images_dir, queries_dir):
+        if os.path.isdir(d):
+            for name in os.listdir(d):
+                os.remove(os.path.join(d, name))
+    filenames = generate_images(images_dir, size, image_size, seed)
+    query_images = generate_images(
+        queries_dir, queries, image_size, seed + 1, prefix="query"
+    )
+    keyword_db = os.path.join(root, "keywords.db")
+    terms = generate_keywords(keyword_db, filenames, vocabulary, seed)
+    stores_dir = os.path.join(root, "stores")
+    os.makedirs(stores_dir, exist_ok=True)
+    build_index(images_dir, output_dir=stores_dir, workers=0, resume=False)
+    manifest = {
+        "settings": settings,
+        "images_dir": images_dir,
+        "query_images": [os.path.join(queries_dir, q) for q in query_images],
+        "keyword_db": keyword_db,
+        "keyword_queries": keyword_queries(terms, queries, seed),
+        "stores": {
+            kind: os.path.join(stores_dir, f"{kind}_dictionary.npy")
+            for kind in ("rgb", "hsv")
+        },
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process's resident memory."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(samples: Sequence[float], items_per_sample: int = 1) -> Result:
+    """Latency percentiles (ms) and throughput (items/s) of timed samples (s)."""
+    arr = np.asarray(samples, dtype=np.float64)
+    total = float(arr.sum())
+    return {
+        "samples": int(arr.size),
+        "p50_ms": float(np.percentile(arr, 50) * 1e3),
+        "p95_ms": float(np.percentile(arr, 95) * 1e3),
+        "mean_ms": float(arr.mean() * 1e3),
+        "throughput": items_per_sample * arr.size / total if total > 0 else 0.0,
+    }
+
+
+def _timed(fn: Callable[[], Any], before: Optional[Callable[[], None]] = None) -> float:
+    if before is not None:
+        before()
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _clear_caches() -> None:
+    from histogram import clear_database_cache
+    from keyword_store import clear_keyword_cache
+    from query_cache import descriptor_cache, result_cache
+
+    clear_database_cache()
+    clear_keyword_cache()
+    descriptor_cache.clear()
+    result_cache.clear()
+
+
+def _build_case(case: Case, manifest: Dict[str, Any]) -> Tuple[List[float], int]:
+    import indexer
+    import hsv_index
+    import rgb_index
+
+    images_dir = manifest["images_dir"]
+    scratch = os.path.join(os.path.dirname(images_dir), "scratch")
+    os.makedirs(scratch, exist_ok=True)
+    workers = case["workers"]
+    if case["target"] == "build_rgb_index":
+
+        def run() -> None:
+            rgb_index.build_rgb_index(images_dir, workers=workers)
+            rgb_index.save_rgb_store(os.path.join(scratch, "rgb_dictionary.npy"))
+
+    elif case["target"] == "build_hsv_index":
+
+        def run() -> None:
+            hsv_index.build_hsv_index(images_dir, workers=workers)
+            hsv_index.save_hsv_store(os.path.join(scratch, "hsv_dictionary.npy"))
+
+    else:
+
+        def run() -> None:
+            indexer.build_index(
+                images_dir, output_dir=scratch, workers=workers, resume=False
+            )
+
+    samples = [_timed(run) for _ in range(case["repeat"])]
+    return samples, manifest["settings"]["size"]
+
+
+def _search_case(case: Case, manifest: Dict[str, Any]) -> Tuple[List[float], int]:
+    import boolean
+    import histogram
+    import vectorielle
+    from query_cache import descriptor_cache
+
+    top_k = case["top_k"]
+    target = case["target"]
+    if target in ("boolean", "vectorielle"):
+        search = (
+            boolean.search_images if target == "boolean" else vectorielle.search_images
+        )
+        queries = manifest["keyword_queries"]
+
+        def query(q: str) -> Any:
+            return search(
+                q, top_k=top_k, keyword_db=manifest["keyword_db"], use_cache=False
+            )
+
+    else:
+        color_space = case["color_space"]
+        search = (
+            histogram.search_images_by_histogram
+            if color_space == "rgb"
+            else histogram.search_images_by_hsv_histogram
+        )
+        store = manifest["stores"][color_space]
+        queries = manifest["query_images"]
+
+        def query(q: str) -> Any:
+            return search(q, store, metric=case["metric"], top_k=top_k, use_cache=False)
+
+    # Load stores and indexes once: the cases measure steady-state queries
+    query(queries[0])
+    samples = []
+    for _ in range(case["repeat"]):
+        for q in queries:
+            # Query descriptors are cached even with use_cache=False
+            samples.append(_timed(lambda: query(q), descriptor_cache.clear))
+    return samples, 1
+
+
+def run_case(case: Case, manifest: Dict[str, Any]) -> Result:
+    """Run one benchmark case in the current process."""
+    _clear_caches()
+    runner = _build_case if case["kind"] == "build" else _search_case
+    samples, items = runner(case, manifest)
+    result = {
+        "name": case["name"],
+        "size": manifest["settings"]["size"],
+        "unit": "images/s" if case["kind"] == "build" else "queries/s",
+    }
+    result.update(summarize(samples, items))
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def benchmark_cases(
+    targets: Optional[Sequence[str]] = None,
+    metrics: Sequence[str] = METRICS,
+    repeat: int = 1,
+    build_repeat: int = 1,
+    top_k: Optional[int] = 100,
+    workers: int = 1,
+) -> List[Case]:
+    """Every case, optionally restricted to names starting with one of ``targets``."""
+    cases: List[Case] = []
+    for target in ("build_rgb_index", "build_hsv_index", "build_index"):
+        cases.append(
+            {
+                "name": target,
+                "kind": "build",
+                "target": target,
+                "repeat": build_repeat,
+                "workers": workers,
+            }
+        )
+    for color_space in ("rgb", "hsv"):
+        for metric in metrics:
+            cases.append(
+                {
+                    "name": f"histogram_{color_space}_{metric}",
+                    "kind": "search",
+                    "target": "histogram",
+                    "color_space": color_space,
+                    "metric": metric,
+                    "repeat": repeat,
+                    "top_k": top_k,
+                }
+            )
+    for target in ("boolean", "vectorielle"):
+        cases.append(
+            {
+                "name": target,
+                "kind": "search",
+                "target": target,
+                "repeat": repeat,
+                "top_k": top_k,
+            }
+        )
+    if targets:
+        cases = [c for c in cases if c["name"].startswith(tuple(targets))]
+    return cases
+
+
+def run_benchmarks(
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    cases: Optional[List[Case]] = None,
+    workdir: str = DEFAULT_WORKDIR,
+    image_size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+    queries: int = DEFAULT_QUERIES,
+    vocabulary: int = DEFAULT_VOCABULARY,
+    seed: int = 0,
+    isolate: bool = True,
+) -> Dict[str, Any]:
+    """Run ``cases`` (default: all) on a dataset of each size; returns the report.
+
+    With ``isolate`` each case runs in a fresh process, so ``peak_rss_mb`` is
+    that case's own peak rather than the whole run's.
+    """
+    cases = benchmark_cases() if cases is None else cases
+    results: List[Result] = []
+    for size in sizes:
+        manifest = prepare_dataset(workdir, size, image_size, queries, vocabulary, seed)
+        for case in cases:
+            if isolate:
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_case, case, manifest).result()
+            else:
+                result = run_case(case, manifest)
+            logger.info(
+                "n=%d %-28s p50 %9.3f ms  p95 %9.3f ms  %10.1f %s  %7.1f MB",
+                size,
+                result["name"],
+                result["p50_ms"],
+                result["p95_ms"],
+                result["throughput"],
+                result["unit"],
+                result["peak_rss_mb"],
+            )
+            results.append(result)
+    return {
+        "format": BENCHMARK_FORMAT,
+        "version": BENCHMARK_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "sizes": list(sizes),
+            "image_size": list(image_size),
+            "queries": queries,
+            "vocabulary": vocabulary,
+            "seed": seed,
+            "isolate": isolate,
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """Per-case changes between two reports; ``regression`` is set past ``threshold``.
+
+    A case regresses when its p50 latency grew, or its throughput dropped, by
+    more than ``threshold`` (a fraction). Cases missing from either report
+    are skipped.
+    """
+    base = {(r["name"], r["size"]): r for r in baseline.get("results", [])}
+    changes = []
+    for r in current.get("results", []):
+        old = base.get((r["name"], r["size"]))
+        if old is None:
+            continue
+        latency = r["p50_ms"] / old["p50_ms"] - 1.0 if old["p50_ms"] > 0 else 0.0
+        throughput = (
+            r["throughput"] / old["throughput"] - 1.0 if old["throughput"] > 0 else 0.0
+        )
+        changes.append(
+            {
+                "name": r["name"],
+                "size": r["size"],
+                "p50_change": latency,
+                "throughput_change": throughput,
+                "regression": latency > threshold or throughput < -threshold,
+            }
+        )
+    return changes
+
+
+def _load_report(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if report.get("format") != BENCHMARK_FORMAT:
+        raise ValueError(f"Not a benchmark report: {path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexing and searches")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="run the benchmarks and write a JSON report")
+    run.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    run.add_argument(
+        "--cases", nargs="*", help="name prefixes, e.g. build histogram_rgb"
+    )
+    run.add_argument("--metrics", nargs="+", default=list(METRICS))
+    run.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    run.add_argument("--repeat", type=int, default=1, help="passes over the queries")
+    run.add_argument("--build-repeat", type=int, default=1)
+    run.add_argument("--top-k", type=int, default=100)
+    run.add_argument(
+        "--workers", type=int, default=1, help="build workers (0: all CPUs)"
+    )
+    run.add_argument(
+        "--image-size", type=int, nargs=2, default=list(DEFAULT_IMAGE_SIZE)
+    )
+    run.add_argument("--vocabulary", type=int, default=DEFAULT_VOCABULARY)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    run.add_argument("--no-isolate", action="store_true", help="run cases in-process")
+    run.add_argument("--output", default="benchmark.json")
+    run.add_argument("--baseline", help="compare against this report when done")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    cmp_parser = sub.add_parser("compare", help="compare two JSON reports")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+
+    if args.command == "run":
+        report = run_benchmarks(
+            args.sizes,
+            benchmark_cases(
+                args.cases,
+                args.metrics,
+                args.repeat,
+                args.build_repeat,
+                args.top_k,
+                args.workers,
+            ),
+            args.workdir,
+            tuple(args.image_size),
+            args.queries,
+            args.vocabulary,
+            args.seed,
+            isolate=not args.no_isolate,
+        )
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logger.info("Wrote %d result(s) to %s", len(report["results"]), args.output)
+        if not args.baseline:
+            sys.exit(0)
+        baseline, current = _load_report(args.baseline), report
+    else:
+        baseline, current = _load_report(args.baseline), _load_report(args.current)
+
+    changes = compare_results(baseline, current, args.threshold)
+    for c in changes:
+        logger.info(
+            "n=%d %-28s p50 %+6.1f%%  throughput %+6.1f%%%s",
+            c["size"],
+            c["name"],
+            100 * c["p50_change"],
+            100 * c["throughput_change"],
+            "  REGRESSION" if c["regression"] else "",
+        )
+    regressions = sum(c["regression"] for c in changes)
+    logger.info("%d regression(s) over %.0f%%", regressions, 100 * args.threshold)
+    sys.exit(1 if regressions else 0)
@@ -1,9 +1,31 @@
-from index import dictionnaire
+from instrumentation import NULL_STATS, instrumented
+from keyword_store import DEFAULT_KEYWORD_DB, load_keywords
+from query_cache import index_id, result_cache
 import cv2 as cv
+import logging
 import os
 
-def search_images(recherche):
-    result_images = []
+logger = logging.getLogger(__name__)
+
+
+@instrumented("boolean.search")
+def search_images(recherche, top_k=None, keyword_db=DEFAULT_KEYWORD_DB, explain=False,
+                  use_cache=True, stats=NULL_STATS):
+    # top_k: return at most k matching images
+    # explain: also return a dict of per-query diagnostics (mode, posting sizes)
+    # use_cache: answer repeated queries from query_cache.result_cache
+    # stats: instrumentation.QueryStats filled with per-stage timings and counters
+    with stats.stage("load"):
+        keywords = load_keywords(keyword_db)
+    cache_index = index_id("keywords", keyword_db)
+    cache_params = ("boolean", recherche.lower(), top_k)
+    if use_cache and not explain:
+        cached = result_cache.get(cache_index, keywords.version, cache_params)
+        if cached is not None:
+            stats.count("cache_hits")
+            return list(cached)
+        stats.count("cache_misses")
+
     ou = False
     mot_cle = recherche.lower().split(" ")
 
@@ -11,21 +33,33 @@ def search_images(recherche):
         ou = True
         mot_cle.remove("+")
 
-    mot_cle = set(mot_cle)
-
-    for elem in dictionnaire:
-        features = dictionnaire[elem]
-        print(features)
-        features = set(features)
-        print(features)
+    # Loaded lazily and shared with vectorielle; reloaded when the store changes
+    with stats.stage("index"):
+        index = keywords.inverted
+    with stats.stage("match"):
         if ou:
-            common_features = mot_cle.intersection(features)
-            if common_features:
-                result_images.append(elem)
+            ids = index.match_any(mot_cle)
         else:
-            if mot_cle.issubset(features):
-                result_images.append(elem)
+            ids = index.match_all(mot_cle)
+    stats.count("rows_scanned", sum(len(index.postings_for(mot)) for mot in set(mot_cle)))
+    stats.count("candidates_scored", len(ids))
+    if top_k is not None:
+        ids = ids[: max(top_k, 0)]
 
+    result_images = index.names(ids)
+    logger.debug("boolean '%s': %d image(s)", recherche, len(result_images))
+    if explain:
+        details = {
+            "query": recherche,
+            "mode": "or" if ou else "and",
+            "keywords": list(mot_cle),
+            "postings": {mot: len(index.postings_for(mot)) for mot in mot_cle},
+            "matches": len(result_images),
+        }
+        return result_images, details
+    if use_cache:
+        result_cache.put(cache_index, keywords.version, cache_params,
+                         tuple(result_images))
     return result_images
 
 
@@ -0,0 +1,87 @@
+from typing import Dict, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+# Color histograms shared by the indexers and the searches, so database rows
+# and query descriptors always come from the same code. A descriptor is the
+# concatenation of one ``bins``-bin histogram per channel (3 * bins floats).
+# RGB reads the BGR channels in reverse order instead of converting the image;
+# HSV converts once (OpenCV 8-bit hue spans [0, 180)). Each channel histogram
+# is written by ``calcHist`` straight into its slice of the output row.
+DEFAULT_BINS = 256
+DEFAULT_NORMALIZE = True
+
+# color space -> ((source channel, value range) for each output channel)
+CHANNELS: Dict[str, Tuple[Tuple[int, Tuple[int, int]], ...]] = {
+    "rgb": ((2, (0, 256)), (1, (0, 256)), (0, (0, 256))),
+    "hsv": ((0, (0, 180)), (1, (0, 256)), (2, (0, 256))),
+}
+_CONVERSIONS: Dict[str, Optional[int]] = {"rgb": None, "hsv": cv.COLOR_BGR2HSV}
+
+
+def _check_color_space(color_space: str) -> str:
+    color_space = color_space.lower()
+    if color_space not in CHANNELS:
+        raise ValueError(f"Unknown color space '{color_space}'")
+    return color_space
+
+
+def _fill_row(image: np.ndarray, color_space: str, bins: int, row: np.ndarray) -> None:
+    for c, (channel, value_range) in enumerate(CHANNELS[color_space]):
+        cv.calcHist(
+            [image],
+            [channel],
+            None,
+            [bins],
+            list(value_range),
+            hist=row[c * bins : (c + 1) * bins].reshape(bins, 1),
+        )
+
+
+def _normalize_rows(rows: np.ndarray) -> None:
+    """L1-normalize each row in place; all-zero rows are left as is."""
+    sums = rows.sum(axis=1, keepdims=True)
+    np.divide(rows, sums, out=rows, where=sums > 0)
+
+
+def compute_histogram(
+    image_bgr: np.ndarray,
+    color_space: str = "rgb",
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+) -> np.ndarray:
+    """Histogram descriptor of one BGR image (a float32 vector of ``3 * bins``)."""
+    if image_bgr is None or image_bgr.size == 0:
+        raise ValueError(f"Empty image provided to compute_{color_space}_histogram")
+    color_space = _check_color_space(color_space)
+    out = np.empty(3 * bins, dtype=np.float32)
+    conversion = _CONVERSIONS[color_space]
+    image = image_bgr if conversion is None else cv.cvtColor(image_bgr, conversion)
+    _fill_row(image, color_space, bins, out)
+    if normalize:
+        _normalize_rows(out.reshape(1, -1))
+    return out
+
+
+def compute_rgb_histogram(
+    image_bgr: np.ndarray,
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+) -> np.ndarray:
+    """Concatenated R, G, B channel histograms (3 * bins floats)."""
+    return compute_histogram(image_bgr, "rgb", bins, normalize)
+
+
+def compute_hsv_histogram(
+    image_bgr: np.ndarray,
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+) -> np.ndarray:
+    """Concatenated H, S, V channel histograms (3 * bins floats).
+
+    OpenCV's 8-bit hue ranges over [0, 180); it still gets ``bins`` bins so
+    every descriptor has the same length.
+    """
+    return compute_histogram(image_bgr, "hsv", bins, normalize)
@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from histogram import (
+    DEFAULT_QUERY_BLOCK,
+    HistogramDatabase,
+    chi_square_kernel,
+    load_histogram_database,
+    pairwise_distances,
+    resolve_metric,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate detection over a histogram store. Pairs are found with blocked
+# (queries x store) distance matrices over the upper triangle only, so no
+# Python loop runs per pair. Bhattacharyya and chi-square never increase when
+# bins are merged, so with ``coarse_bins`` the re-binned distance is a lower
+# bound: pairs over the threshold there are dropped without loss, and only
+# the survivors are scored at full resolution.
+DEFAULT_THRESHOLD = 0.1
+LOWER_BOUND_METRICS = ("bhattacharyya", "chi2")
+
+Pair = Tuple[int, int, float]
+
+
+class UnionFind:
+    """Disjoint sets over ``0..n-1`` with path halving and union by size."""
+
+    def __init__(self, n: int) -> None:
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        ri, rj = self.find(i), self.find(j)
+        if ri == rj:
+            return
+        if self.size[ri] < self.size[rj]:
+            ri, rj = rj, ri
+        self.parent[rj] = ri
+        self.size[ri] += self.size[rj]
+
+    def groups(self, min_size: int = 2) -> List[List[int]]:
+        """Sets with at least ``min_size`` members, each sorted, ordered by first member."""
+        members: Dict[int, List[int]] = {}
+        for i in range(len(self.parent)):
+            members.setdefault(self.find(i), []).append(i)
+        return sorted((g for g in members.values() if len(g) >= min_size), key=min)
+
+
+def _pair_distances(
+    db: HistogramDatabase, metric: str, normalize: bool, i: np.ndarray, j: np.ndarray
+) -> np.ndarray:
+    """Full-resolution distance of each pair ``(i[k], j[k])``."""
+    if metric == "bhattacharyya":
+        sqrt_p = db.sqrt_probabilities
+        bc = np.einsum("ij,ij->i", sqrt_p[i], sqrt_p[j])
+        return np.sqrt(1.0 - np.clip(bc, 0.0, 1.0))
+    matrix = db.normalized if normalize else db.matrix
+    a, b = matrix[i], matrix[j]
+    if metric == "chi2":
+        return chi_square_kernel(a, b)
+    return np.sqrt(np.einsum("ij,ij->i", a - b, a - b))
+
+
+def find_duplicate_pairs(
+    db: HistogramDatabase,
+    threshold: float = DEFAULT_THRESHOLD,
+    metric: str = "bhattacharyya",
+    normalize: bool = True,
+    coarse_bins: Optional[int] = None,
+    block: int = DEFAULT_QUERY_BLOCK,
+) -> List[Pair]:
+    """Every pair of rows ``(i, j, distance)`` with ``i < j`` and distance <= threshold.
+
+    ``coarse_bins`` (e.g. 16 or 32) enables the lossless coarse prefilter for
+    Bhattacharyya and chi-square; it is ignored for L2, which has no such
+    bound.
+    """
+    metric = resolve_metric(metric)
+    if coarse_bins is not None and metric not in LOWER_BOUND_METRICS:
+        logger.warning("coarse_bins ignored: no lower bound for metric '%s'", metric)
+        coarse_bins = None
+    n = len(db)
+    queries = db.normalized if normalize or metric == "bhattacharyya" else db.matrix
+    found_i: List[np.ndarray] = []
+    found_j: List[np.ndarray] = []
+    found_d: List[np.ndarray] = []
+    for qs in range(0, n, block):
+        qe = min(n, qs + block)
+        # Upper triangle: rows qs..n-1, keeping j > i below
+        rows = np.arange(qs, n)
+        d = pairwise_distances(queries[qs:qe], db, metric, normalize, rows, coarse_bins)
+        d[np.tril_indices(qe - qs, m=n - qs)] = np.inf
+        bi, bj = np.nonzero(d <= threshold)
+        i, j = bi + qs, bj + qs
+        if coarse_bins is not None and i.size:
+            exact = _pair_distances(db, metric, normalize, i, j)
+            keep = exact <= threshold
+            i, j, dist = i[keep], j[keep], exact[keep]
+        else:
+            dist = d[bi, bj]
+        found_i.append(i)
+        found_j.append(j)
+        found_d.append(dist)
+    if not found_i:
+        return []
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    dist = np.concatenate(found_d)
+    return list(zip(i.tolist(), j.tolist(), dist.astype(float).tolist()))
+
+
+def cluster_pairs(n: int, pairs: List[Pair]) -> List[List[int]]:
+    """Connected components (size >= 2) of the duplicate graph."""
+    sets = UnionFind(n)
+    for i, j, _ in pairs:
+        sets.union(i, j)
+    return sets.groups()
+
+
+def duplicate_report(
+    store_path: str,
+    color_space: str,
+    threshold: float = DEFAULT_THRESHOLD,
+    metric: str = "bhattacharyya",
+    normalize: bool = True,
+    coarse_bins: Optional[int] = None,
+) -> Dict:
+    """Find near-duplicates in a store; returns a JSON-serializable report."""
+    db = load_histogram_database(store_path, color_space)
+    pairs = find_duplicate_pairs(db, threshold, metric, normalize, coarse_bins)
+    clusters = cluster_pairs(len(db), pairs)
+    names = db.filenames
+    return {
+        "store": os.path.abspath(store_path),
+        "color_space": color_space,
+        "metric": resolve_metric(metric),
+        "threshold": threshold,
+        "normalize": normalize,
+        "images": len(db),
+        "pairs": [[names[i], names[j], round(d, 6)] for i, j, d in pairs],
+        "clusters": [[names[i] for i in group] for group in clusters],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate images")
+    parser.add_argument("--store", default="rgb_dictionary.npy")
+    parser.add_argument("--color-space", default="rgb")
+    parser.add_argument("--metric", default="bhattacharyya")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--coarse-bins", type=int, default=None)
+    parser.add_argument("--raw", action="store_true", help="do not L1-normalize")
+    parser.add_argument("--report", default="duplicates.json")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+
+    report = duplicate_report(
+        args.store,
+        args.color_space,
+        threshold=args.threshold,
+        metric=args.metric,
+        normalize=not args.raw,
+        coarse_bins=args.coarse_bins,
+    )
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(
+        "%d pair(s) in %d cluster(s) among %d image(s); report written to %s",
+        len(report["pairs"]),
+        len(report["clusters"]),
+        report["images"],
+        args.report,
+    )
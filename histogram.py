@@ -1,66 +1,362 @@
 import json
 import os
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import cv2 as cv
 import numpy as np
 
-
-DEFAULT_BINS = 256
-DEFAULT_NORMALIZE = True
+from descriptors import (
+    CHANNELS,
+    DEFAULT_BINS,
+    DEFAULT_NORMALIZE,
+    compute_hsv_histogram,
+    compute_rgb_histogram,
+)
+from histogram_store import (
+    is_store_path,
+    load_histogram_store,
+    store_mtime_ns,
+)
+from instrumentation import NULL_STATS, QueryStats, instrumented
+from query_cache import (
+    LoaderCache,
+    array_digest,
+    descriptor_cache,
+    file_digest,
+    result_cache,
+)
+
+# Image path, BGR image array, PIL image or precomputed histogram (see as_query)
+QueryInput = Union[str, os.PathLike, np.ndarray]
+
+# Descriptor resolution: images are decoded at 1/``reduce`` scale (JPEG DCT
+# scaling through IMREAD_REDUCED_COLOR_*), then stride-sampled down to at most
+# ``max_pixels`` pixels. L1-normalized histograms barely change, and decoding
+# cost follows the pixel count. Stores record the setting in their sidecar and
+# queries use the store's setting.
+FULL_RESOLUTION: Dict[str, Optional[int]] = {"reduce": 1, "max_pixels": None}
+_IMREAD_FLAGS = {
+    1: cv.IMREAD_COLOR,
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def descriptor_resolution(
+    reduce: int = 1, max_pixels: Optional[int] = None
+) -> Dict[str, Optional[int]]:
+    if reduce not in _IMREAD_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(_IMREAD_FLAGS)}, got {reduce}")
+    if max_pixels is not None and max_pixels <= 0:
+        raise ValueError("max_pixels must be positive")
+    return {"reduce": reduce, "max_pixels": max_pixels}
+
+
+def subsample_pixels(image: np.ndarray, max_pixels: Optional[int]) -> np.ndarray:
+    """Strided view of ``image`` with at most ``max_pixels`` pixels (no copy)."""
+    if max_pixels is None:
+        return image
+    pixels = image.shape[0] * image.shape[1]
+    if pixels <= max_pixels:
+        return image
+    step = int(np.ceil(np.sqrt(pixels / max_pixels)))
+    return image[::step, ::step]
+
+
+def reduce_image(
+    image: np.ndarray, resolution: Optional[Dict[str, Optional[int]]]
+) -> np.ndarray:
+    """Apply a descriptor resolution to an already decoded image."""
+    resolution = resolution or FULL_RESOLUTION
+    reduce = resolution.get("reduce") or 1
+    if reduce > 1:
+        h, w = image.shape[:2]
+        size = (max(1, -(-w // reduce)), max(1, -(-h // reduce)))
+        image = cv.resize(image, size, interpolation=cv.INTER_AREA)
+    return subsample_pixels(image, resolution.get("max_pixels"))
+
+
+def read_descriptor_image(
+    path: str, resolution: Optional[Dict[str, Optional[int]]] = None
+) -> Optional[np.ndarray]:
+    """Decode ``path`` at a descriptor resolution; ``None`` if OpenCV cannot read it."""
+    resolution = resolution or FULL_RESOLUTION
+    img = cv.imread(path, _IMREAD_FLAGS[resolution.get("reduce") or 1])
+    if img is None:
+        return None
+    return subsample_pixels(img, resolution.get("max_pixels"))
 
 
-def load_rgb_dictionary(
-    json_path: str = "rgb_dictionary.json",
-) -> Dict[str, List[float]]:
+def _read_by_filename(json_path: str, label: str) -> Dict[str, List[float]]:
+    if is_store_path(json_path):
+        matrix, meta = _read_store(json_path, label)
+        return {fname: row.tolist() for fname, row in zip(meta["filenames"], matrix)}
     if not os.path.isfile(json_path):
-        raise FileNotFoundError(f"RGB dictionary JSON not found: {json_path}")
+        raise FileNotFoundError(f"{label} dictionary JSON not found: {json_path}")
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
     by_filename = data.get("by_filename")
     if not isinstance(by_filename, dict):
-        raise ValueError("Invalid rgb_dictionary.json format: missing 'by_filename'")
+        raise ValueError(
+            f"Invalid {os.path.basename(json_path)} format: missing 'by_filename'"
+        )
     return by_filename
 
 
+def _read_store(store_path: str, label: str) -> Tuple[np.ndarray, dict]:
+    matrix, meta = load_histogram_store(store_path)
+    color_space = meta.get("color_space")
+    if color_space and color_space != label.lower():
+        raise ValueError(
+            f"{store_path} holds {color_space.upper()} histograms, not {label}"
+        )
+    return matrix, meta
+
+
+def load_rgb_dictionary(
+    json_path: str = "rgb_dictionary.json",
+) -> Dict[str, List[float]]:
+    return _read_by_filename(json_path, "RGB")
+
+
 def load_hsv_dictionary(
     json_path: str = "hsv_dictionary.json",
 ) -> Dict[str, List[float]]:
-    if not os.path.isfile(json_path):
-        raise FileNotFoundError(f"HSV dictionary JSON not found: {json_path}")
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    by_filename = data.get("by_filename")
-    if not isinstance(by_filename, dict):
-        raise ValueError("Invalid hsv_dictionary.json format: missing 'by_filename'")
-    return by_filename
+    return _read_by_filename(json_path, "HSV")
+
+
+class HistogramDatabase:
+    """Histogram store held as one contiguous float32 matrix.
+
+    Row ``i`` of ``matrix`` is the histogram of ``filenames[i]``. The matrix is
+    either parsed from JSON or memory-mapped from a binary store; nothing is
+    read at load time. The derived views (``normalized``,
+    ``sqrt_probabilities``, signatures) are computed on first use and cached.
+    ``normalized`` is ``matrix`` itself for stores built with ``normalize``;
+    the other views are private to the process, not shared pages of the store.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        filenames: List[str],
+        matrix: np.ndarray,
+        mtime_ns: int = 0,
+        meta: Optional[dict] = None,
+    ) -> None:
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.meta = meta or {}
+        self.filenames = np.asarray(filenames, dtype=object)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if self.matrix.ndim != 2 or self.matrix.shape[0] != len(self.filenames):
+            raise ValueError("Histogram matrix must be (N, D) with one row per file")
+        self._sums: Optional[np.ndarray] = None
+        self._normalized: Optional[np.ndarray] = None
+        self._sqrt_probabilities: Optional[np.ndarray] = None
+        self._signatures: Dict[Tuple[str, int], np.ndarray] = {}
+        self._rows_by_name: Optional[Dict[str, int]] = None
+        self._rows_by_digest: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def is_normalized(self) -> bool:
+        """Whether the rows are color histograms L1-normalized by the indexer."""
+        meta = self.meta
+        return bool(meta.get("normalize")) and meta.get("color_space") in CHANNELS
+
+    @property
+    def sums(self) -> np.ndarray:
+        if self._sums is None:
+            self._sums = self.matrix.sum(axis=1)
+        return self._sums
+
+    @property
+    def normalized(self) -> np.ndarray:
+        """L1-normalized rows (rows summing to zero are kept as is).
+
+        ``matrix`` itself when the store is already normalized, else a copy.
+        """
+        if self._normalized is None:
+            if self.is_normalized:
+                self._normalized = self.matrix
+            else:
+                scale = np.where(self.sums > 0, self.sums, 1.0).astype(np.float32)
+                self._normalized = self.matrix / scale[:, None]
+        return self._normalized
+
+    @property
+    def sqrt_probabilities(self) -> np.ndarray:
+        """Element-wise sqrt of the clipped, L1-normalized rows (Bhattacharyya side).
+
+        Always a private ``(N, D)`` float32 copy, built on first use.
+        """
+        if self._sqrt_probabilities is None:
+            if self.is_normalized:
+                # Histogram counts are never negative: no clipping needed
+                self._sqrt_probabilities = np.sqrt(self.matrix)
+            else:
+                p = np.clip(self.matrix, 0, None)
+                s = p.sum(axis=1)
+                p /= np.where(s > 0, s, 1.0).astype(np.float32)[:, None]
+                self._sqrt_probabilities = np.sqrt(p, out=p)
+        return self._sqrt_probabilities
+
+    def signature(self, bins: int, kind: str = "normalized") -> np.ndarray:
+        """Rows re-binned to ``bins`` per channel, computed once and cached.
+
+        ``kind`` selects the source rows: ``"raw"`` (``matrix``),
+        ``"normalized"`` or ``"sqrt"`` (square roots of the re-binned
+        probabilities, for Bhattacharyya).
+        """
+        key = (kind, bins)
+        if key not in self._signatures:
+            if kind == "sqrt":
+                probabilities = np.square(self.sqrt_probabilities)
+                sig = np.sqrt(rebin_histograms(probabilities, bins))
+            elif kind == "normalized":
+                sig = rebin_histograms(self.normalized, bins)
+            else:
+                sig = rebin_histograms(self.matrix, bins)
+            self._signatures[key] = sig
+        return self._signatures[key]
+
+    def find_row(self, path: str, digest: Optional[str] = None) -> Optional[int]:
+        """Row already holding the histogram of ``path``, if it was indexed as is.
+
+        Uses the fingerprints recorded by the indexer: same file name, size and
+        mtime, or else the same content SHA-1 (stores built with
+        ``content_hash``). Stores without fingerprints never match.
+        """
+        fingerprints = self.meta.get("fingerprints")
+        if not fingerprints:
+            return None
+        if self._rows_by_name is None:
+            self._rows_by_name = {f: i for i, f in enumerate(self.filenames)}
+            self._rows_by_digest = {
+                fp[2]: self._rows_by_name[f]
+                for f, fp in fingerprints.items()
+                if fp[2] and f in self._rows_by_name
+            }
+        name = os.path.basename(path)
+        row = self._rows_by_name.get(name)
+        fp = fingerprints.get(name)
+        if row is not None and fp:
+            st = os.stat(path)
+            if fp[0] == st.st_size and fp[1] == st.st_mtime_ns:
+                return row
+        if digest is not None:
+            return self._rows_by_digest.get(digest)
+        return None
+
+    @classmethod
+    def from_dictionary(
+        cls, by_filename: Dict[str, List[float]], path: str = "", mtime_ns: int = 0
+    ) -> "HistogramDatabase":
+        filenames = list(by_filename.keys())
+        if not filenames:
+            return cls(path, [], np.zeros((0, 0), dtype=np.float32), mtime_ns)
+        dim = len(by_filename[filenames[0]])
+        matrix = np.empty((len(filenames), dim), dtype=np.float32)
+        for i, fname in enumerate(filenames):
+            row = by_filename[fname]
+            if len(row) != dim:
+                raise ValueError(
+                    f"Inconsistent histogram length for '{fname}': "
+                    f"{len(row)} != {dim}"
+                )
+            matrix[i] = row
+        return cls(path, filenames, matrix, mtime_ns)
+
+
+# Loaded databases, keyed by (kind, absolute path) and versioned by mtime
+_database_cache = LoaderCache()
+
+
+def _load_database(
+    json_path: str, label: str, stats: QueryStats = NULL_STATS
+) -> HistogramDatabase:
+    path = os.path.abspath(json_path)
+    key = (label, path)
+    try:
+        if is_store_path(json_path):
+            mtime_ns = store_mtime_ns(json_path)
+        else:
+            mtime_ns = os.stat(json_path).st_mtime_ns
+    except OSError:
+        _database_cache.discard(key)
+        raise FileNotFoundError(f"{label} histogram database not found: {json_path}")
+
+    def load() -> HistogramDatabase:
+        stats.count("database_loads")
+        if is_store_path(json_path):
+            # Memory-mapped: pages are shared between processes searching the store
+            matrix, meta = _read_store(json_path, label)
+            return HistogramDatabase(path, meta["filenames"], matrix, mtime_ns, meta)
+        stats.count("bytes_read", os.path.getsize(json_path))
+        return HistogramDatabase.from_dictionary(
+            _read_by_filename(json_path, label), path=path, mtime_ns=mtime_ns
+        )
 
+    return _database_cache.get(key, mtime_ns, load)
+
+
+def load_histogram_database(path: str, color_space: str) -> HistogramDatabase:
+    """Load any histogram store by color space name (``"rgb"``, ``"hsv"``, ...)."""
+    return _load_database(path, color_space.upper())
+
+
+def load_rgb_database(json_path: str = "rgb_dictionary.json") -> HistogramDatabase:
+    return _load_database(json_path, "RGB")
+
+
+def load_hsv_database(json_path: str = "hsv_dictionary.json") -> HistogramDatabase:
+    return _load_database(json_path, "HSV")
+
+
+def clear_database_cache() -> None:
+    _database_cache.clear()
 
-def compute_rgb_histogram(
-    image_bgr: np.ndarray, bins: int = DEFAULT_BINS, normalize: bool = DEFAULT_NORMALIZE
-) -> np.ndarray:
-    if image_bgr is None or image_bgr.size == 0:
-        raise ValueError("Empty image provided to compute_rgb_histogram")
 
-    image_rgb = cv.cvtColor(image_bgr, cv.COLOR_BGR2RGB)
-    hist_r = cv.calcHist([image_rgb], [0], None, [bins], [0, 256])
-    hist_g = cv.calcHist([image_rgb], [1], None, [bins], [0, 256])
-    hist_b = cv.calcHist([image_rgb], [2], None, [bins], [0, 256])
-    hist = np.concatenate([hist_r, hist_g, hist_b], axis=0).astype(np.float32).ravel()
+# Keeps the chi-square denominator non-zero for bins empty on both sides
+CHI2_EPS = 1e-12
 
-    if normalize:
-        s = hist.sum()
-        if s > 0:
-            hist /= s
-    return hist
+
+def chi_square_kernel(
+    a: np.ndarray, b: np.ndarray, eps: float = CHI2_EPS
+) -> np.ndarray:
+    """``0.5 * sum((a - b)^2 / (a + b + eps))`` over the last axis (broadcast).
+
+    Integer inputs are scored in floating point (at least float32).
+    """
+    a, b = np.asarray(a), np.asarray(b)
+    dtype = np.result_type(a, b, np.float32)
+    num = np.subtract(a, b, dtype=dtype)
+    num *= num
+    den = np.add(a, b, dtype=dtype)
+    den += eps
+    num /= den
+    return 0.5 * num.sum(axis=-1)
 
 
 def l2_distance(a: np.ndarray, b: np.ndarray) -> float:
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
     return float(np.linalg.norm(a - b))
 
 
-def chi_square_distance(p: np.ndarray, q: np.ndarray, eps: float = 1e-12) -> float:
-    return float(0.5 * np.sum(((p - q) ** 2) / (p + q + eps)))
+def chi_square_distance(p: np.ndarray, q: np.ndarray, eps: float = CHI2_EPS) -> float:
+    p = np.asarray(p, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
+    return float(chi_square_kernel(p, q, eps))
 
 
 def bhattacharyya_distance(p: np.ndarray, q: np.ndarray) -> float:
@@ -78,114 +374,604 @@ def bhattacharyya_distance(p: np.ndarray, q: np.ndarray) -> float:
     return float(np.sqrt(max(0.0, 1.0 - bc)))
 
 
-def search_images_by_histogram(
-    query_image_path: str,
-    db_json_path: str = "rgb_dictionary.json",
-    bins: int = DEFAULT_BINS,
-    normalize: bool = DEFAULT_NORMALIZE,
-    metric: str = "chi2",
-) -> Tuple[List[str], Dict[str, float]]:
-    if not os.path.isfile(query_image_path):
-        raise FileNotFoundError(f"Query image not found: {query_image_path}")
-
-    # Load database
-    db = load_rgb_dictionary(db_json_path)
+def rebin_histograms(hists: np.ndarray, bins: int, channels: int = 3) -> np.ndarray:
+    """Merge adjacent bins of concatenated per-channel histograms.
 
-    # Load and compute query histogram
-    img = cv.imread(query_image_path)
-    if img is None:
+    Works on a single vector or an ``(N, D)`` matrix; the per-channel bin count
+    must be a multiple of ``bins``. Sums are preserved, so L1-normalized input
+    stays normalized.
+    """
+    hists = np.asarray(hists, dtype=np.float32)
+    in_bins = hists.shape[-1] // channels
+    if in_bins * channels != hists.shape[-1] or in_bins % bins:
         raise ValueError(
-            "cv.imread returned None for query image (unsupported or unreadable)"
+            f"Cannot re-bin {hists.shape[-1]}-long histograms to {bins} bins/channel"
         )
-    q_hist = compute_rgb_histogram(img, bins=bins, normalize=normalize)
-
-    # Compare
-    distances: Dict[str, float] = {}
-    q_len = q_hist.shape[0]
-    for fname, hist_list in db.items():
-        # Ensure vector sizes match; skip otherwise
-        h = np.asarray(hist_list, dtype=np.float32).ravel()
-        if h.shape[0] != q_len:
-            # Different bin configuration; skip
-            continue
-        # Safeguard: L1 normalize DB hist as well if requested
-        if normalize:
-            s = h.sum()
-            if s > 0:
-                h = h / s
+    grouped = hists.reshape(hists.shape[:-1] + (channels, bins, in_bins // bins))
+    return np.ascontiguousarray(grouped.sum(axis=-1).reshape(hists.shape[:-1] + (-1,)))
 
-        if metric == "bhattacharyya":
-            d = bhattacharyya_distance(q_hist, h)
-        elif metric in ("chi2", "chi_square", "chi-square"):
-            d = chi_square_distance(q_hist, h)
-        elif metric in ("l2", "euclidean"):
-            d = l2_distance(q_hist, h)
-        else:
-            d = bhattacharyya_distance(q_hist, h)
-        distances[fname] = d
 
-    sorted_images = [k for k, _ in sorted(distances.items(), key=lambda x: x[1])]
-    return sorted_images, distances
+# Rows scored per NumPy pass; bounds the temporaries of the element-wise kernels
+DEFAULT_CHUNK_ROWS = 4096
 
 
-def compute_hsv_histogram(
-    image_bgr: np.ndarray, bins: int = DEFAULT_BINS, normalize: bool = DEFAULT_NORMALIZE
+def l2_distances(
+    q: np.ndarray, matrix: np.ndarray, chunk_rows: int = DEFAULT_CHUNK_ROWS
+) -> np.ndarray:
+    """L2 distance between ``q`` and every row of ``matrix``."""
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], chunk_rows):
+        diff = matrix[start : start + chunk_rows] - q
+        out[start : start + chunk_rows] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return out
+
+
+def chi_square_distances(
+    q: np.ndarray,
+    matrix: np.ndarray,
+    eps: float = CHI2_EPS,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> np.ndarray:
+    """Chi-square distance between ``q`` and every row of ``matrix``."""
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], chunk_rows):
+        block = matrix[start : start + chunk_rows]
+        out[start : start + chunk_rows] = chi_square_kernel(block, q, eps)
+    return out
+
+
+def bhattacharyya_distances(q: np.ndarray, sqrt_matrix: np.ndarray) -> np.ndarray:
+    """Bhattacharyya distance between ``q`` and every row of a database.
+
+    ``sqrt_matrix`` holds the square roots of the L1-normalized database rows
+    (see ``HistogramDatabase.sqrt_probabilities``), so the Bhattacharyya
+    coefficients reduce to a single matrix-vector product.
+    """
+    p = np.clip(q, 0, None).astype(np.float32)
+    s = p.sum()
+    if s > 0:
+        p /= s
+    bc = sqrt_matrix @ np.sqrt(p)
+    np.clip(bc, 0.0, 1.0, out=bc)
+    return np.sqrt(1.0 - bc)
+
+
+def resolve_metric(metric: str) -> str:
+    """Canonical metric name: ``"chi2"``, ``"l2"`` or ``"bhattacharyya"``."""
+    if metric in ("chi2", "chi_square", "chi-square"):
+        return "chi2"
+    if metric in ("l2", "euclidean"):
+        return "l2"
+    # Unknown names fall back to Bhattacharyya
+    return "bhattacharyya"
+
+
+def _scoring_matrix(
+    db: HistogramDatabase, metric: str, normalize: bool, coarse_bins: Optional[int]
 ) -> np.ndarray:
-    if image_bgr is None or image_bgr.size == 0:
-        raise ValueError("Empty image provided to compute_hsv_histogram")
+    """Database rows ``metric`` (already resolved) is computed against."""
+    if coarse_bins is not None:
+        if metric == "bhattacharyya":
+            kind = "sqrt"
+        else:
+            kind = "normalized" if normalize else "raw"
+        return db.signature(coarse_bins, kind)
+    if metric == "bhattacharyya":
+        return db.sqrt_probabilities
+    # Safeguard: L1 normalize DB hist as well if requested
+    return db.normalized if normalize else db.matrix
+
+
+def compute_distances(
+    q_hist: np.ndarray,
+    db: HistogramDatabase,
+    metric: str,
+    normalize: bool,
+    rows: Optional[np.ndarray] = None,
+    coarse_bins: Optional[int] = None,
+) -> np.ndarray:
+    """Distances from ``q_hist`` to every row of ``db``, in database order.
+
+    If ``rows`` (an index array) is given, only those rows are scored and the
+    result is aligned with ``rows``. With ``coarse_bins`` both sides are
+    re-binned to that many bins per channel first (see ``rebin_histograms``).
+    """
+    metric = resolve_metric(metric)
+    if coarse_bins is not None:
+        q_hist = rebin_histograms(q_hist, coarse_bins)
+    matrix = _scoring_matrix(db, metric, normalize, coarse_bins)
+    if rows is not None:
+        matrix = matrix[rows]
+    if metric == "bhattacharyya":
+        return bhattacharyya_distances(q_hist, matrix)
+    if metric == "chi2":
+        return chi_square_distances(q_hist, matrix)
+    return l2_distances(q_hist, matrix)
+
+
+def select_top_k(
+    d: np.ndarray, top_k: Optional[int] = None, max_distance: Optional[float] = None
+) -> np.ndarray:
+    """Indices of the ``top_k`` smallest distances (at most ``max_distance``), sorted.
+
+    Uses ``np.partition`` so only the selected rows are sorted; ties keep
+    database order, as with a full stable sort. ``top_k=None`` keeps every row.
+    """
+    candidates = np.arange(d.shape[0])
+    if max_distance is not None:
+        candidates = candidates[d <= max_distance]
+    if top_k is not None:
+        if top_k <= 0:
+            return candidates[:0]
+        if top_k < candidates.shape[0]:
+            sub = d[candidates]
+            kth = np.partition(sub, top_k - 1)[top_k - 1]
+            keep = sub < kth
+            # Fill the remaining slots with the earliest rows tied at the k-th value
+            ties = np.flatnonzero(sub == kth)[: top_k - int(keep.sum())]
+            keep[ties] = True
+            candidates = candidates[keep]
+    return candidates[np.argsort(d[candidates], kind="stable")]
+
+
+# Candidates kept by the coarse stage of a two-stage search
+DEFAULT_RERANK = 200
+
+
+def _rank(
+    q_hist: np.ndarray,
+    db: HistogramDatabase,
+    metric: str,
+    normalize: bool,
+    top_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    nprobe: Optional[int] = None,
+    coarse_bins: Optional[int] = None,
+    rerank: int = DEFAULT_RERANK,
+    stats: QueryStats = NULL_STATS,
+) -> Tuple[List[str], Dict[str, float]]:
+    if len(db) == 0 or db.dim != q_hist.shape[0]:
+        # Different bin configuration; nothing comparable
+        return [], {}
+    rows = None
+    if nprobe is not None:
+        # Approximate: only score the rows of the nprobe closest IVF lists
+        from ann_index import load_ivf_index
+
+        with stats.stage("probe"):
+            rows = load_ivf_index(db).candidates(q_hist, nprobe)
+    stats.count("rows_scanned", len(db) if rows is None else len(rows))
+    if coarse_bins is not None:
+        # Two-stage: shortlist on the re-binned signatures, then rank exactly
+        with stats.stage("coarse"):
+            d = compute_distances(q_hist, db, metric, normalize, rows, coarse_bins)
+            shortlist = select_top_k(d, max(rerank, top_k or 0))
+            rows = np.sort(shortlist if rows is None else rows[shortlist])
+    with stats.stage("distance"):
+        d = compute_distances(q_hist, db, metric, normalize, rows)
+    stats.count("candidates_scored", d.shape[0])
+    with stats.stage("select"):
+        selected = select_top_k(d, top_k, max_distance)
+    order = selected if rows is None else rows[selected]
+    sorted_images = db.filenames[order].tolist()
+    return sorted_images, dict(zip(sorted_images, d[selected].tolist()))
 
-    hsv = cv.cvtColor(image_bgr, cv.COLOR_BGR2HSV)
-    hist_h = cv.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv.calcHist([hsv], [2], None, [bins], [0, 256])
-    hist = np.concatenate([hist_h, hist_s, hist_v], axis=0).astype(np.float32).ravel()
 
-    if normalize:
-        s = hist.sum()
-        if s > 0:
-            hist /= s
-    return hist
+def search_images_by_histogram(
+    query_image_path: QueryInput,
+    db_json_path: str = "rgb_dictionary.npy",
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+    metric: str = "chi2",
+    top_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    nprobe: Optional[int] = None,
+    coarse_bins: Optional[int] = None,
+    rerank: int = DEFAULT_RERANK,
+    use_cache: bool = True,
+    stats: Optional[QueryStats] = None,
+) -> Tuple[List[str], Dict[str, float]]:
+    """Rank the RGB store against ``query_image_path``, closest first.
+
+    ``top_k`` limits the ranking (and the returned distances) to the k closest
+    images and ``max_distance`` drops anything farther; by default the full
+    ranking is returned. With ``nprobe`` the search is approximate: only the
+    images in the ``nprobe`` closest lists of the store's IVF index (see
+    ``ann_index``) are scored. With ``coarse_bins`` (e.g. 16 or 32) the
+    search runs in two stages: every image is scored on histograms re-binned
+    to ``coarse_bins`` per channel, and only the best ``rerank`` are ranked
+    at full resolution. Repeated queries (same image content and settings)
+    are answered from ``query_cache.result_cache`` unless ``use_cache`` is off.
+    The query may also be an in-memory image or histogram, see
+    ``search_histogram_database``. Pass a ``QueryStats`` as ``stats`` to get
+    the time spent in each stage (see ``instrumentation``).
+    """
+    return search_histogram_database(
+        query_image_path,
+        db_json_path,
+        "rgb",
+        bins,
+        normalize,
+        metric,
+        top_k,
+        max_distance,
+        nprobe,
+        coarse_bins,
+        rerank,
+        use_cache,
+        stats=stats,
+    )
 
 
 def search_images_by_hsv_histogram(
-    query_image_path: str,
-    db_json_path: str = "hsv_dictionary.json",
+    query_image_path: QueryInput,
+    db_json_path: str = "hsv_dictionary.npy",
     bins: int = DEFAULT_BINS,
     normalize: bool = DEFAULT_NORMALIZE,
     metric: str = "bhattacharyya",
+    top_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    nprobe: Optional[int] = None,
+    coarse_bins: Optional[int] = None,
+    rerank: int = DEFAULT_RERANK,
+    use_cache: bool = True,
+    stats: Optional[QueryStats] = None,
 ) -> Tuple[List[str], Dict[str, float]]:
-    if not os.path.isfile(query_image_path):
-        raise FileNotFoundError(f"Query image not found: {query_image_path}")
-
-    db = load_hsv_dictionary(db_json_path)
-
-    img = cv.imread(query_image_path)
-    if img is None:
-        raise ValueError(
-            "cv.imread returned None for query image (unsupported or unreadable)"
-        )
-    q_hist = compute_hsv_histogram(img, bins=bins, normalize=normalize)
-
-    distances: Dict[str, float] = {}
-    q_len = q_hist.shape[0]
-    for fname, hist_list in db.items():
-        h = np.asarray(hist_list, dtype=np.float32).ravel()
-        if h.shape[0] != q_len:
-            continue
+    """HSV counterpart of ``search_images_by_histogram``."""
+    return search_histogram_database(
+        query_image_path,
+        db_json_path,
+        "hsv",
+        bins,
+        normalize,
+        metric,
+        top_k,
+        max_distance,
+        nprobe,
+        coarse_bins,
+        rerank,
+        use_cache,
+        stats=stats,
+    )
+
+
+# Query histogram per color space: fn(image_bgr, bins, normalize)
+HISTOGRAM_EXTRACTORS = {"RGB": compute_rgb_histogram, "HSV": compute_hsv_histogram}
+
+
+def as_query(query: QueryInput) -> Union[str, np.ndarray]:
+    """``query`` as a path string or an array (BGR image or histogram).
+
+    ``str`` and ``os.PathLike`` queries are paths; NumPy arrays and PIL images
+    are in-memory queries, PIL images being converted to BGR.
+    """
+    if isinstance(query, np.ndarray):
+        return query
+    if isinstance(query, (str, os.PathLike)):
+        return os.fspath(query)
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is not None and isinstance(query, Image.Image):
+        return np.ascontiguousarray(np.asarray(query.convert("RGB"))[:, :, ::-1])
+    raise TypeError(f"Unsupported query type: {type(query).__name__}")
+
+
+def query_digest(query: QueryInput) -> str:
+    """Content digest of a query (file, image array or histogram)."""
+    query = as_query(query)
+    if isinstance(query, np.ndarray):
+        kind = "histogram" if query.ndim == 1 else "image"
+        return f"{kind}:{array_digest(query)}"
+    return file_digest(query)
+
+
+def query_histogram(
+    query: QueryInput,
+    label: str,
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+    db: Optional[HistogramDatabase] = None,
+    digest: Optional[str] = None,
+    resolution: Optional[Dict[str, Optional[int]]] = None,
+    stats: QueryStats = NULL_STATS,
+) -> np.ndarray:
+    """Histogram of a query in the ``label`` color space (``"RGB"``, ``"HSV"``).
+
+    ``query`` is an image path, a BGR image array ``(H, W, 3)``, a PIL image
+    or an already computed histogram ``(3 * bins,)``. For a path, the row stored in ``db``
+    is reused when the file is indexed unchanged with the same ``bins`` and
+    ``normalize``. Other paths and image arrays are decoded once; their
+    histograms are kept in ``query_cache.descriptor_cache`` by ``digest``
+    (see ``query_digest``). Images are reduced to ``resolution``, by default
+    the one recorded in ``db`` (see ``descriptor_resolution``).
+    """
+    label = label.upper()
+    query = as_query(query)
+    if isinstance(query, np.ndarray) and query.ndim == 1:
+        if query.shape[0] != 3 * bins:
+            raise ValueError(
+                f"Query histogram has {query.shape[0]} values, expected {3 * bins}"
+            )
+        q_hist = query.astype(np.float32)
         if normalize:
-            s = h.sum()
+            s = q_hist.sum()
             if s > 0:
-                h = h / s
+                q_hist /= s
+        return q_hist
+    if isinstance(query, np.ndarray) and (query.ndim != 3 or query.shape[2] != 3):
+        raise ValueError(
+            f"Query array of shape {query.shape} is neither a BGR image "
+            f"(H, W, 3) nor a histogram ({3 * bins},)"
+        )
 
-        if metric == "bhattacharyya":
-            d = bhattacharyya_distance(q_hist, h)
-        elif metric in ("chi2", "chi_square", "chi-square"):
-            d = chi_square_distance(q_hist, h)
-        elif metric in ("l2", "euclidean"):
-            d = l2_distance(q_hist, h)
+    if isinstance(query, str) and not os.path.isfile(query):
+        raise FileNotFoundError(f"Query image not found: {query}")
+    digest = digest or query_digest(query)
+    db_resolution = FULL_RESOLUTION
+    if db is not None:
+        db_resolution = db.meta.get("resolution") or FULL_RESOLUTION
+    resolution = resolution or db_resolution
+    if (
+        isinstance(query, str)
+        and db is not None
+        and db.meta.get("bins") == bins
+        and db.meta.get("normalize") == normalize
+        and resolution == db_resolution
+    ):
+        row = db.find_row(query, digest)
+        if row is not None:
+            stats.count("stored_row_hits")
+            return np.array(db.matrix[row])
+    cache_index = (label, "")
+    cache_params = (
+        digest,
+        bins,
+        normalize,
+        resolution.get("reduce"),
+        resolution.get("max_pixels"),
+    )
+    cached = descriptor_cache.get(cache_index, 0, cache_params)
+    if cached is not None:
+        stats.count("descriptor_cache_hits")
+        return cached
+    with stats.stage("decode"):
+        if isinstance(query, str):
+            # Load and compute query histogram
+            img = read_descriptor_image(query, resolution)
+            if img is None:
+                raise ValueError(
+                    "cv.imread returned None for query image "
+                    "(unsupported or unreadable)"
+                )
+            stats.count("bytes_read", os.path.getsize(query))
         else:
-            d = bhattacharyya_distance(q_hist, h)
-        distances[fname] = d
-
-    sorted_images = [k for k, _ in sorted(distances.items(), key=lambda x: x[1])]
+            img = reduce_image(query, resolution)
+    with stats.stage("histogram"):
+        q_hist = HISTOGRAM_EXTRACTORS[label](img, bins=bins, normalize=normalize)
+    q_hist.flags.writeable = False
+    descriptor_cache.put(cache_index, 0, cache_params, q_hist)
+    return q_hist
+
+
+@instrumented("histogram.search")
+def search_histogram_database(
+    query: QueryInput,
+    db_path: str,
+    color_space: str = "rgb",
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+    metric: str = "bhattacharyya",
+    top_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    nprobe: Optional[int] = None,
+    coarse_bins: Optional[int] = None,
+    rerank: int = DEFAULT_RERANK,
+    use_cache: bool = True,
+    stats: QueryStats = NULL_STATS,
+) -> Tuple[List[str], Dict[str, float]]:
+    """Rank the ``color_space`` store at ``db_path`` against ``query``.
+
+    ``query`` is an image path, a BGR image array or a precomputed histogram
+    (see ``query_histogram``); the other arguments are those of
+    ``search_images_by_histogram``. ``stats`` records the load, digest,
+    descriptor and rank stages with rows scanned, candidates scored, cache
+    hits and bytes read.
+    """
+    label = color_space.upper()
+    if label not in HISTOGRAM_EXTRACTORS:
+        raise ValueError(f"Unknown color space: {color_space}")
+    query = as_query(query)
+    if isinstance(query, str) and not os.path.isfile(query):
+        raise FileNotFoundError(f"Query image not found: {query}")
+
+    # Load database (parsed once per process, reloaded when the file changes)
+    with stats.stage("load"):
+        db = _load_database(db_path, label, stats)
+    with stats.stage("digest"):
+        digest = query_digest(query)
+
+    cache_index = (label, db.path)
+    cache_params = None
+    if use_cache:
+        # Keyed by query content, so copies and renamed files hit too
+        ivf_version = None
+        if nprobe is not None:
+            from ann_index import ivf_path
+
+            try:
+                ivf_version = os.stat(ivf_path(db.path)).st_mtime_ns
+            except OSError:
+                pass
+        cache_params = (
+            "histogram",
+            digest,
+            bins,
+            normalize,
+            resolve_metric(metric),
+            top_k,
+            max_distance,
+            nprobe,
+            ivf_version,
+            coarse_bins,
+            rerank if coarse_bins is not None else None,
+        )
+        cached = result_cache.get(cache_index, db.mtime_ns, cache_params)
+        if cached is not None:
+            stats.count("cache_hits")
+            return list(cached[0]), dict(cached[1])
+        stats.count("cache_misses")
+
+    with stats.stage("descriptor"):
+        q_hist = query_histogram(query, label, bins, normalize, db, digest, stats=stats)
+    with stats.stage("rank"):
+        sorted_images, distances = _rank(
+            q_hist,
+            db,
+            metric,
+            normalize,
+            top_k,
+            max_distance,
+            nprobe,
+            coarse_bins,
+            rerank,
+            stats,
+        )
+    if use_cache:
+        result_cache.put(
+            cache_index,
+            db.mtime_ns,
+            cache_params,
+            (tuple(sorted_images), dict(distances)),
+        )
     return sorted_images, distances
+
+
+# Queries scored together per pass of a batch search; bounds the (M, N) block
+DEFAULT_QUERY_BLOCK = 256
+# Element budget of one (queries x rows x D) chi-square tile
+_CHI2_TILE_ELEMENTS = 1 << 22
+
+
+def pairwise_distances(
+    queries: np.ndarray,
+    db: HistogramDatabase,
+    metric: str,
+    normalize: bool,
+    rows: Optional[np.ndarray] = None,
+    coarse_bins: Optional[int] = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> np.ndarray:
+    """``(M, N)`` distances from each of the ``M`` query histograms to each row.
+
+    Bhattacharyya and L2 are scored with one matrix-matrix product per chunk
+    of database rows; chi-square, which has no product form, in tiles of
+    queries x rows. Values match ``compute_distances`` up to float32
+    rounding; ``rows`` and ``coarse_bins`` have the same meaning.
+    """
+    metric = resolve_metric(metric)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if coarse_bins is not None:
+        queries = rebin_histograms(queries, coarse_bins)
+    matrix = _scoring_matrix(db, metric, normalize, coarse_bins)
+    n = len(db) if rows is None else len(rows)
+
+    def rows_block(start: int, stop: int) -> np.ndarray:
+        return matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+
+    out = np.empty((queries.shape[0], n), dtype=np.float32)
+    if metric == "bhattacharyya":
+        p = np.clip(queries, 0, None)
+        s = p.sum(axis=1, keepdims=True)
+        p /= np.where(s > 0, s, 1.0)
+        sqrt_q = np.sqrt(p)
+        for start in range(0, n, chunk_rows):
+            bc = sqrt_q @ rows_block(start, start + chunk_rows).T
+            np.clip(bc, 0.0, 1.0, out=bc)
+            out[:, start : start + chunk_rows] = np.sqrt(1.0 - bc)
+        return out
+
+    if metric == "l2":
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        for start in range(0, n, chunk_rows):
+            block = rows_block(start, start + chunk_rows)
+            d2 = block @ queries.T
+            d2 *= -2.0
+            d2 += np.einsum("ij,ij->i", block, block)[:, None]
+            d2 += q_sq
+            np.maximum(d2, 0.0, out=d2)
+            out[:, start : start + chunk_rows] = np.sqrt(d2).T
+        return out
+
+    q_tile = min(queries.shape[0], 16)
+    r_tile = max(1, _CHI2_TILE_ELEMENTS // (q_tile * max(1, matrix.shape[1])))
+    for start in range(0, n, r_tile):
+        block = np.asarray(rows_block(start, start + r_tile))[None, :, :]
+        for qs in range(0, queries.shape[0], q_tile):
+            q = queries[qs : qs + q_tile, None, :]
+            out[qs : qs + q_tile, start : start + r_tile] = chi_square_kernel(block, q)
+    return out
+
+
+@instrumented("histogram.batch_search")
+def search_histogram_batch(
+    queries: Sequence[QueryInput],
+    db_path: str,
+    color_space: str = "rgb",
+    bins: int = DEFAULT_BINS,
+    normalize: bool = DEFAULT_NORMALIZE,
+    metric: str = "bhattacharyya",
+    top_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    workers: Optional[int] = 1,
+    query_block: int = DEFAULT_QUERY_BLOCK,
+    stats: QueryStats = NULL_STATS,
+) -> List[Tuple[List[str], Dict[str, float]]]:
+    """Rank the store against many queries at once; one result per query.
+
+    Each entry is what ``search_histogram_database`` returns for that
+    query. Query histograms are obtained with ``query_histogram`` (indexed
+    images reuse their stored rows) on ``workers`` threads (``None`` or
+    ``0``: one per CPU), then scored ``query_block`` at a time with
+    ``pairwise_distances``. Results are not stored in the result cache.
+    """
+    label = color_space.upper()
+    if label not in HISTOGRAM_EXTRACTORS:
+        raise ValueError(f"Unknown color space: {color_space}")
+    with stats.stage("load"):
+        db = _load_database(db_path, label, stats)
+    queries = list(queries)
+    if not queries:
+        return []
+
+    def describe(query: QueryInput) -> np.ndarray:
+        return query_histogram(query, label, bins, normalize, db, stats=stats)
+
+    workers = workers or os.cpu_count() or 1
+    with stats.stage("descriptor"):
+        if workers > 1 and len(queries) > 1:
+            # OpenCV releases the GIL while decoding and computing histograms
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                q_hists = list(pool.map(describe, queries))
+        else:
+            q_hists = [describe(query) for query in queries]
+    if len(db) == 0 or any(q.shape[0] != db.dim for q in q_hists):
+        # Different bin configuration; nothing comparable
+        return [([], {}) for _ in queries]
+
+    results: List[Tuple[List[str], Dict[str, float]]] = []
+    for qs in range(0, len(q_hists), max(1, query_block)):
+        block = np.vstack(q_hists[qs : qs + max(1, query_block)])
+        with stats.stage("distance"):
+            distances = pairwise_distances(block, db, metric, normalize)
+        stats.count("rows_scanned", distances.size)
+        stats.count("candidates_scored", distances.size)
+        for d in distances:
+            with stats.stage("select"):
+                selected = select_top_k(d, top_k, max_distance)
+            sorted_images = db.filenames[selected].tolist()
+            results.append(
+                (sorted_images, dict(zip(sorted_images, d[selected].tolist())))
+            )
+    return results
@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Binary histogram store: a float32 (N, D) matrix saved as ``<name>.npy`` plus a
+# small ``<name>.meta.json`` sidecar holding filenames and build settings.
+STORE_FORMAT = "iri-histogram-store"
+STORE_VERSION = 1
+STORE_EXTENSION = ".npy"
+# Rows sampled by ``matrix_checksum``; enough to tell two versions of a store apart
+CHECKSUM_ROWS = 1024
+# Attempts of ``load_histogram_store`` while the store is being rewritten
+LOAD_ATTEMPTS = 3
+
+
+def is_store_path(path: str) -> bool:
+    return path.lower().endswith(STORE_EXTENSION)
+
+
+def sidecar_path(store_path: str) -> str:
+    base = (
+        store_path[: -len(STORE_EXTENSION)] if is_store_path(store_path) else store_path
+    )
+    return base + ".meta.json"
+
+
+def store_mtime_ns(store_path: str) -> int:
+    """Latest modification time of the matrix and its sidecar."""
+    return max(
+        os.stat(store_path).st_mtime_ns, os.stat(sidecar_path(store_path)).st_mtime_ns
+    )
+
+
+def matrix_checksum(matrix: np.ndarray) -> str:
+    """SHA-1 of the shape and of up to ``CHECKSUM_ROWS`` evenly spaced rows.
+
+    Recorded in the sidecar so a reader can tell that the matrix it opened is
+    the one the sidecar describes, without reading the whole store.
+    """
+    digest = hashlib.sha1(repr(tuple(matrix.shape)).encode("ascii"))
+    n = matrix.shape[0]
+    if n:
+        rows = np.unique(np.linspace(0, n - 1, min(n, CHECKSUM_ROWS)).astype(np.int64))
+        digest.update(np.ascontiguousarray(matrix[rows], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def _atomic_write_json(path: str, payload: Dict[str, Any]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def save_histogram_store(
+    store_path: str,
+    filenames: List[str],
+    matrix: np.ndarray,
+    color_space: str,
+    bins: int,
+    normalize: bool,
+    extra: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Write ``matrix`` (one row per filename) and its sidecar to ``store_path``."""
+    if not is_store_path(store_path):
+        raise ValueError(f"Histogram store path must end with '{STORE_EXTENSION}'")
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(filenames):
+        raise ValueError("Histogram matrix must be (N, D) with one row per filename")
+
+    # Matrix first, sidecar last; in between, readers see a checksum mismatch
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, store_path)
+    _write_sidecar(
+        store_path,
+        filenames,
+        matrix.shape,
+        color_space,
+        bins,
+        normalize,
+        extra,
+        matrix_checksum(matrix),
+    )
+
+
+def _write_sidecar(
+    store_path: str,
+    filenames: List[str],
+    shape: Tuple[int, ...],
+    color_space: str,
+    bins: int,
+    normalize: bool,
+    extra: Optional[Dict[str, Any]] = None,
+    checksum: Optional[str] = None,
+) -> None:
+    meta: Dict[str, Any] = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "color_space": color_space,
+        "bins": int(bins),
+        "normalize": bool(normalize),
+        "shape": list(shape),
+        "checksum": checksum,
+        "filenames": list(filenames),
+    }
+    if extra:
+        meta.update(extra)
+    _atomic_write_json(sidecar_path(store_path), meta)
+
+
+class StoreWriter:
+    """Builds a store row by row with bounded memory and resumable checkpoints.
+
+    Rows are buffered in a preallocated ``(chunk_rows, D)`` float32 block and
+    appended to ``<store>.partial`` (raw float32) whenever it fills up. Each
+    flush is a checkpoint: once the rows are on disk, their filenames and
+    fingerprints are appended as one JSON line to ``<store>.partial.log``.
+    After a crash, a writer opened with ``resume`` keeps every checkpointed
+    row and drops anything written after the last complete log line.
+    ``finalize`` turns the partial file into the ``.npy`` store and sidecar.
+    """
+
+    def __init__(
+        self,
+        store_path: str,
+        color_space: str,
+        bins: int,
+        normalize: bool,
+        extra: Optional[Dict[str, Any]] = None,
+        chunk_rows: int = 1024,
+        resume: bool = False,
+    ) -> None:
+        if not is_store_path(store_path):
+            raise ValueError(f"Histogram store path must end with '{STORE_EXTENSION}'")
+        self.store_path = store_path
+        self.data_path = store_path + ".partial"
+        self.log_path = store_path + ".partial.log"
+        self.chunk_rows = max(1, chunk_rows)
+        self.settings: Dict[str, Any] = {
+            "color_space": color_space,
+            "bins": int(bins),
+            "normalize": bool(normalize),
+            "extra": extra or {},
+        }
+        self.filenames: List[str] = []
+        self.fingerprints: Dict[str, Any] = {}
+        self.dim: Optional[int] = None
+        self._buffer: Optional[np.ndarray] = None
+        self._pending: List[Tuple[str, Any]] = []
+        if not (resume and self._load_checkpoint()):
+            self._start()
+
+    def __len__(self) -> int:
+        return len(self.filenames) + len(self._pending)
+
+    def _start(self) -> None:
+        open(self.data_path, "wb").close()
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"settings": self.settings}, ensure_ascii=False) + "\n")
+
+    def _load_checkpoint(self) -> bool:
+        """Reload a previous run with the same settings; ``False`` if there is none."""
+        if not (os.path.isfile(self.data_path) and os.path.isfile(self.log_path)):
+            return False
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return False
+        if header.get("settings") != json.loads(json.dumps(self.settings)):
+            return False
+        complete = []
+        # The last line may have been cut short by the crash: ignore it
+        for line in lines[1:-1]:
+            try:
+                complete.append(json.loads(line))
+            except ValueError:
+                break
+        for chunk in complete:
+            self.dim = chunk["dim"]
+            for fname, fingerprint in chunk["rows"]:
+                self.filenames.append(fname)
+                self.fingerprints[fname] = fingerprint
+        self.truncate(len(self.filenames))
+        return True
+
+    def truncate(self, rows: int) -> None:
+        """Keep the first ``rows`` checkpointed rows (used to align several stores)."""
+        self._pending.clear()
+        del self.filenames[rows:]
+        self.fingerprints = {f: self.fingerprints.get(f) for f in self.filenames}
+        with open(self.data_path, "r+b") as f:
+            f.truncate(rows * (self.dim or 0) * 4)
+        # Rewrite the log so it matches the kept rows exactly
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"settings": self.settings}, ensure_ascii=False) + "\n")
+            if self.filenames:
+                chunk = {
+                    "dim": self.dim,
+                    "rows": [[n, self.fingerprints[n]] for n in self.filenames],
+                }
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.log_path)
+
+    def append(self, filename: str, row: np.ndarray, fingerprint: Any = None) -> None:
+        row = np.asarray(row, dtype=np.float32).ravel()
+        if self.dim is None:
+            self.dim = row.shape[0]
+        if row.shape[0] != self.dim:
+            raise ValueError(
+                f"Inconsistent histogram length for '{filename}': "
+                f"{row.shape[0]} != {self.dim}"
+            )
+        if self._buffer is None:
+            self._buffer = np.empty((self.chunk_rows, self.dim), dtype=np.float32)
+        self._buffer[len(self._pending)] = row
+        self._pending.append((filename, fingerprint))
+        if len(self._pending) == self.chunk_rows:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Write the buffered rows, then record them in the log."""
+        if not self._pending:
+            return
+        with open(self.data_path, "ab") as f:
+            f.write(self._buffer[: len(self._pending)].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        chunk = {"dim": self.dim, "rows": [[n, fp] for n, fp in self._pending]}
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for fname, fingerprint in self._pending:
+            self.filenames.append(fname)
+            self.fingerprints[fname] = fingerprint
+        self._pending.clear()
+
+    def finalize(self) -> None:
+        """Write the ``.npy`` store and its sidecar, then drop the partial files."""
+        self.checkpoint()
+        shape = (len(self.filenames), self.dim or 0)
+        tmp_path = self.store_path + ".tmp"
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=shape
+        )
+        if out.size:
+            # An empty partial file cannot be memory-mapped
+            rows = np.memmap(self.data_path, dtype=np.float32, mode="r", shape=shape)
+            for start in range(0, shape[0], self.chunk_rows):
+                end = start + self.chunk_rows
+                out[start:end] = rows[start:end]
+            del rows
+        out.flush()
+        checksum = matrix_checksum(out)
+        del out
+        os.replace(tmp_path, self.store_path)
+        extra = dict(self.settings["extra"])
+        if any(fp is not None for fp in self.fingerprints.values()):
+            extra["fingerprints"] = self.fingerprints
+        _write_sidecar(
+            self.store_path,
+            self.filenames,
+            shape,
+            self.settings["color_space"],
+            self.settings["bins"],
+            self.settings["normalize"],
+            extra,
+            checksum,
+        )
+        self.abort()
+
+    def abort(self) -> None:
+        for path in (self.data_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_store_meta(store_path: str) -> Dict[str, Any]:
+    meta_path = sidecar_path(store_path)
+    if not os.path.isfile(meta_path):
+        raise FileNotFoundError(f"Histogram store sidecar not found: {meta_path}")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != STORE_FORMAT:
+        raise ValueError(f"Invalid histogram store sidecar: {meta_path}")
+    return meta
+
+
+def load_histogram_store(
+    store_path: str, mmap: bool = True
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Return ``(matrix, meta)``; the matrix is memory-mapped read-only by default.
+
+    A matrix that does not match its sidecar (checksum or row count) is being
+    rewritten: the pair is read again, and ``ValueError`` is raised if it
+    still does not match after ``LOAD_ATTEMPTS`` tries.
+    """
+    if not os.path.isfile(store_path):
+        raise FileNotFoundError(f"Histogram store not found: {store_path}")
+    for attempt in range(LOAD_ATTEMPTS):
+        if attempt:
+            time.sleep(0.05 * attempt)
+        meta = load_store_meta(store_path)
+        matrix = np.load(store_path, mmap_mode="r" if mmap else None)
+        if matrix.ndim != 2 or matrix.shape[0] != len(meta.get("filenames", [])):
+            continue
+        # Stores written before checksums were recorded are taken as they are
+        if meta.get("checksum") in (None, matrix_checksum(matrix)):
+            return matrix, meta
+    raise ValueError(
+        f"Histogram store {store_path} does not match its sidecar "
+        f"({matrix.shape} vs {len(meta.get('filenames', []))} filenames, "
+        f"checksum {meta.get('checksum')})"
+    )
+
+
+def export_store_json(store_path: str, json_path: str) -> None:
+    """Export a binary store to the legacy ``by_filename``/``by_index`` JSON layout."""
+    matrix, meta = load_histogram_store(store_path)
+    by_filename = {fname: row.tolist() for fname, row in zip(meta["filenames"], matrix)}
+    by_index = {
+        idx: {"filename": fname, "histogram": by_filename[fname]}
+        for idx, fname in enumerate(sorted(by_filename), start=1)
+    }
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"by_filename": by_filename, "by_index": by_index}, f, ensure_ascii=False
+        )
+
+
+def convert_json_store(
+    json_path: str, store_path: str, color_space: str, normalize: bool = True
+) -> None:
+    """Convert a legacy JSON dictionary into a binary store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        by_filename = json.load(f).get("by_filename")
+    if not isinstance(by_filename, dict):
+        raise ValueError(
+            f"Invalid {os.path.basename(json_path)} format: missing 'by_filename'"
+        )
+    filenames = list(by_filename.keys())
+    matrix = np.asarray([by_filename[f] for f in filenames], dtype=np.float32)
+    if not filenames:
+        matrix = matrix.reshape(0, 0)
+    save_histogram_store(
+        store_path,
+        filenames,
+        matrix,
+        color_space=color_space,
+        bins=matrix.shape[1] // 3,
+        normalize=normalize,
+    )
+
+
+if __name__ == "__main__":
+    # Migrate the shipped JSON dictionaries to binary stores
+    convert_json_store("rgb_dictionary.json", "rgb_dictionary.npy", "rgb")
+    convert_json_store("hsv_dictionary.json", "hsv_dictionary.npy", "hsv")
+    print("[histogram_store] Wrote rgb_dictionary.npy and hsv_dictionary.npy")
@@ -1,111 +1,120 @@
-import os
-import json
-from typing import Dict, List, Tuple
+import logging
+from typing import Any, Dict, List, Optional, Tuple
 
-import cv2 as cv
-import numpy as np
+from descriptors import compute_hsv_histogram
+from indexer import IMAGE_EXTENSIONS, HistogramDictionary, build_store
+from instrumentation import NULL_STATS, QueryStats, instrumented
 
 
+_index = HistogramDictionary("hsv")
 # Global dictionary mapping image filename -> HSV histogram (concatenated H,S,V vectors)
-hsv_dictionary: Dict[str, List[float]] = {}
+hsv_dictionary: Dict[str, List[float]] = _index.by_filename
 # 1-based indexed view: index -> { 'filename': str, 'histogram': List[float] }
-hsv_indexed_dictionary: Dict[int, Dict[str, List[float]]] = {}
+hsv_indexed_dictionary: Dict[int, Dict[str, List[float]]] = _index.by_index
+# Settings used by the last build_hsv_index run; recorded in the binary store
+hsv_build_settings: Dict[str, object] = _index.settings
+# filename -> [size, mtime_ns, sha1 or None] of each indexed file
+hsv_fingerprints: Dict[str, List[Any]] = _index.fingerprints
 
 
-def compute_hsv_histogram(
-    image_bgr: np.ndarray, bins: int = 256, normalize: bool = True
-) -> np.ndarray:
-    """Compute concatenated HSV channel histograms.
-
-    Note: In OpenCV, H ranges in [0, 180], S and V in [0, 256].
-    We still use `bins` bins per channel to keep a fixed-length vector (3*bins).
+@instrumented("hsv_index.build")
+def build_hsv_index(
+    images_dir: str = "images",
+    bins: int = 256,
+    normalize: bool = True,
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    incremental: bool = False,
+    store_path: str = "hsv_dictionary.npy",
+    content_hash: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    stats: QueryStats = NULL_STATS,
+) -> Dict[str, List[float]]:
+    """Index ``images_dir``; ``workers > 1`` (or ``0`` for all CPUs) runs in parallel.
+
+    With ``incremental``, histograms of files unchanged since ``store_path`` was
+    written are reused and only new or modified files are decoded. ``reduce``
+    and ``max_pixels`` set the descriptor resolution (see
+    ``histogram.descriptor_resolution``). Every histogram is kept in memory;
+    large collections should go through ``build_hsv_store`` instead.
+    ``stats`` records the plan, extract and merge stages.
     """
-    if image_bgr is None or image_bgr.size == 0:
-        raise ValueError("Empty image provided to compute_hsv_histogram")
-
-    hsv = cv.cvtColor(image_bgr, cv.COLOR_BGR2HSV)
-
-    hist_h = cv.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv.calcHist([hsv], [2], None, [bins], [0, 256])
-
-    hist = np.concatenate([hist_h, hist_s, hist_v], axis=0).astype(np.float32).ravel()
-
-    if normalize:
-        s = hist.sum()
-        if s > 0:
-            hist /= s
-    return hist
+    return _index.build(
+        images_dir,
+        bins=bins,
+        normalize=normalize,
+        extensions=extensions,
+        workers=workers,
+        use_processes=use_processes,
+        incremental=incremental,
+        store_path=store_path,
+        content_hash=content_hash,
+        reduce=reduce,
+        max_pixels=max_pixels,
+        stats=stats,
+    )
 
 
-def build_hsv_index(
+def build_hsv_store(
     images_dir: str = "images",
+    store_path: str = "hsv_dictionary.npy",
     bins: int = 256,
     normalize: bool = True,
-    extensions: Tuple[str, ...] = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".avif"),
-) -> Dict[str, List[float]]:
-    global hsv_dictionary, hsv_indexed_dictionary
-    hsv_dictionary.clear()
-    hsv_indexed_dictionary.clear()
-
-    if not os.path.isdir(images_dir):
-        print(f"[hsv_index] Directory not found: {images_dir}")
-        return hsv_dictionary
-
-    files = sorted(os.listdir(images_dir))
-    count_ok = 0
-    count_fail = 0
-
-    for fname in files:
-        if not fname.lower().endswith(extensions):
-            continue
-        fpath = os.path.join(images_dir, fname)
-        try:
-            img = cv.imread(fpath)
-            if img is None:
-                raise ValueError(
-                    "cv.imread returned None (unsupported format or unreadable file)"
-                )
-            hist = compute_hsv_histogram(img, bins=bins, normalize=normalize)
-            hsv_dictionary[fname] = hist.tolist()
-            count_ok += 1
-        except Exception as e:
-            print(f"[hsv_index] Skip '{fname}': {e}")
-            count_fail += 1
-
-    # Build stable indexed view (sorted by filename for determinism)
-    for idx, fname in enumerate(sorted(hsv_dictionary.keys()), start=1):
-        hsv_indexed_dictionary[idx] = {
-            "filename": fname,
-            "histogram": hsv_dictionary[fname],
-        }
-
-    print(
-        f"[hsv_index] Indexed {count_ok} image(s), failed {count_fail} in '{images_dir}'."
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    incremental: bool = False,
+    content_hash: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    resume: bool = True,
+    chunk_rows: int = 1024,
+    stats: Optional[QueryStats] = None,
+) -> int:
+    """Stream the HSV histograms of ``images_dir`` straight into ``store_path``.
+
+    Same options as ``build_hsv_index``, but rows are written in blocks of
+    ``chunk_rows`` as they are computed (see ``indexer.build_index``), so
+    memory stays flat and an interrupted run resumes from its last
+    checkpoint. The module-level dictionaries are left untouched. Returns
+    the number of indexed images.
+    """
+    return build_store(
+        images_dir,
+        "hsv",
+        store_path,
+        bins=bins,
+        normalize=normalize,
+        extensions=extensions,
+        workers=workers,
+        use_processes=use_processes,
+        incremental=incremental,
+        content_hash=content_hash,
+        reduce=reduce,
+        max_pixels=max_pixels,
+        resume=resume,
+        chunk_rows=chunk_rows,
+        stats=stats,
     )
-    return hsv_dictionary
+
+
+def save_hsv_store(file_path: str = "hsv_dictionary.npy") -> None:
+    """Save the index as a float32 ``.npy`` matrix plus a ``.meta.json`` sidecar.
+
+    After a build that left no image (e.g. all of them were deleted) an empty
+    store is written, so the old rows do not survive.
+    """
+    _index.save_store(file_path)
 
 
 def save_hsv_dictionary_json(file_path: str = "hsv_dictionary.json") -> None:
-    if not hsv_dictionary:
-        print(
-            "[hsv_index] Nothing to save: hsv_dictionary is empty. Build the index first."
-        )
-        return
-    payload = {
-        "by_filename": hsv_dictionary,
-        "by_index": hsv_indexed_dictionary,
-    }
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
-    print(f"[hsv_index] Wrote JSON dictionary to {file_path}")
+    """Export both filename-keyed and indexed dictionaries to a (legacy) JSON file."""
+    _index.save_json(file_path)
 
 
 if __name__ == "__main__":
-    build_hsv_index("images", bins=256, normalize=True)
-    # small sample print
-    for i, (k, v) in enumerate(hsv_dictionary.items()):
-        print(f"{i + 1:02d}. {k} -> hist length: {len(v)}")
-        if i >= 2:
-            break
-    save_hsv_dictionary_json("hsv_dictionary.json")
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+    # Write the store directly; histograms are never all held in memory
+    build_hsv_store("images", "hsv_dictionary.npy", bins=256, normalize=True)
@@ -1,3 +1,5 @@
+# Legacy keyword-weight literal. Searches read keywords.db; run
+# `python keyword_store.py import` to load this dictionary into it.
 dictionnaire = {
     "Alger Algerie flag architecture.jpg": {
         "flag": 0.9,
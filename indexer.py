@@ -0,0 +1,788 @@
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import numpy as np
+
+from ann_index import ivf_path, update_ivf_index
+from descriptors import (
+    CHANNELS,
+    compute_histogram,
+    compute_hsv_histogram,
+    compute_rgb_histogram,
+)
+from histogram import (
+    FULL_RESOLUTION,
+    HistogramDatabase,
+    descriptor_resolution,
+    pairwise_distances,
+    read_descriptor_image,
+    select_top_k,
+)
+from histogram_store import StoreWriter, load_histogram_store, save_histogram_store
+from instrumentation import NULL_STATS, QueryStats, instrumented
+from query_cache import file_digest
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS: Tuple[str, ...] = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".avif")
+
+T = TypeVar("T")
+
+# Counts from the last build_index run: added/updated/removed/unchanged/failed
+last_index_report: Dict[str, int] = {}
+
+
+def list_image_files(
+    images_dir: str, extensions: Tuple[str, ...] = IMAGE_EXTENSIONS
+) -> List[str]:
+    """Image filenames in ``images_dir``, sorted for deterministic indexing."""
+    return [f for f in sorted(os.listdir(images_dir)) if f.lower().endswith(extensions)]
+
+
+def read_image(
+    fpath: str, resolution: Optional[Dict[str, Optional[int]]] = None
+) -> np.ndarray:
+    """Decode ``fpath``, reduced to a descriptor ``resolution`` if given."""
+    img = read_descriptor_image(fpath, resolution)
+    if img is None:
+        raise ValueError(
+            "cv.imread returned None (unsupported format or unreadable file)"
+        )
+    return img
+
+
+def resolve_workers(workers: Optional[int]) -> int:
+    """``None`` or ``0`` means one worker per CPU."""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+def map_image_files(
+    images_dir: str,
+    filenames: List[str],
+    extract: Callable[[str], T],
+    workers: Optional[int] = 1,
+    use_processes: bool = False,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[Tuple[str, Optional[T], Optional[Exception]]]:
+    """Apply ``extract`` to each image path, yielding ``(fname, result, error)``.
+
+    Results come back in the order of ``filenames`` whatever the worker count.
+    With more than one worker, files are processed on a thread pool (OpenCV
+    releases the GIL while decoding) or, with ``use_processes``, on a process
+    pool; ``extract`` must then be picklable. At most ``max_in_flight`` files
+    (default: twice the worker count) are queued at any time, so memory stays
+    bounded on large directories.
+    """
+    workers = resolve_workers(workers)
+    if workers == 1:
+        for fname in filenames:
+            try:
+                yield fname, extract(os.path.join(images_dir, fname)), None
+            except Exception as e:
+                yield fname, None, e
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    max_in_flight = max(1, max_in_flight)
+
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    pool: Executor
+    with pool_cls(max_workers=workers) as pool:
+        pending: Deque = deque()
+        names = iter(filenames)
+        for fname in names:
+            pending.append(
+                (fname, pool.submit(extract, os.path.join(images_dir, fname)))
+            )
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            fname, future = pending.popleft()
+            try:
+                yield fname, future.result(), None
+            except Exception as e:
+                yield fname, None, e
+            nxt = next(names, None)
+            if nxt is not None:
+                pending.append(
+                    (nxt, pool.submit(extract, os.path.join(images_dir, nxt)))
+                )
+
+
+def file_fingerprint(fpath: str, content_hash: bool = False) -> List[Any]:
+    """``[size, mtime_ns, sha1 or None]`` as recorded in the store sidecar."""
+    st = os.stat(fpath)
+    return [
+        st.st_size,
+        st.st_mtime_ns,
+        file_digest(fpath) if content_hash else None,
+    ]
+
+
+def plan_incremental_update(
+    images_dir: str,
+    files: List[str],
+    store_paths: List[str],
+    bins: int,
+    normalize: bool,
+    content_hash: bool = False,
+    resolution: Optional[Dict[str, Optional[int]]] = None,
+    copy_rows: bool = True,
+    statuses: Optional[Dict[str, str]] = None,
+) -> Tuple[
+    List[Dict[str, np.ndarray]], List[str], Dict[str, List[Any]], Dict[str, int]
+]:
+    """Compare ``files`` against the fingerprints recorded in existing stores.
+
+    Returns ``(reused, to_compute, fingerprints, counts)``: for each store the
+    rows that can be kept as is, the files whose descriptors must be
+    (re)computed, the current fingerprint of every file and the
+    added/updated/removed/unchanged counts. A store that is missing or was
+    built with other settings (bins, normalize, descriptor resolution) is
+    treated as empty. Size and mtime are compared
+    first; with ``content_hash`` a file whose size/mtime changed but whose
+    content did not is still considered unchanged. Without ``copy_rows`` the
+    reused rows are views on the memory-mapped stores, so nothing is read
+    until they are used. ``statuses``, if given, receives the status of each
+    file (see ``count_failures``).
+    """
+    stores = []
+    known = set()
+    for path in store_paths:
+        try:
+            matrix, meta = load_histogram_store(path)
+        except (FileNotFoundError, ValueError):
+            stores.append(None)
+            continue
+        if (
+            meta.get("bins") != bins
+            or meta.get("normalize") != normalize
+            or (meta.get("resolution") or FULL_RESOLUTION)
+            != (resolution or FULL_RESOLUTION)
+        ):
+            stores.append(None)
+            continue
+        positions = {f: i for i, f in enumerate(meta["filenames"])}
+        known.update(positions)
+        stores.append((matrix, meta.get("fingerprints", {}), positions))
+
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    reused: List[Dict[str, np.ndarray]] = [{} for _ in store_paths]
+    to_compute: List[str] = []
+    fingerprints: Dict[str, List[Any]] = {}
+    for fname in files:
+        fpath = os.path.join(images_dir, fname)
+        st = os.stat(fpath)
+        fp: List[Any] = [st.st_size, st.st_mtime_ns, None]
+        status = "unchanged"
+        for store in stores:
+            if store is None or fname not in store[2]:
+                status = "updated" if fname in known else "added"
+                break
+            old = store[1].get(fname)
+            if not old:
+                status = "updated"
+                break
+            if old[:2] == fp[:2]:
+                fp[2] = fp[2] or old[2]
+                continue
+            if content_hash and old[2]:
+                if fp[2] is None:
+                    fp[2] = file_digest(fpath)
+                if fp[2] == old[2]:
+                    continue
+            status = "updated"
+            break
+        if content_hash and fp[2] is None:
+            fp[2] = file_digest(fpath)
+        fingerprints[fname] = fp
+        counts[status] += 1
+        if statuses is not None:
+            statuses[fname] = status
+        if status == "unchanged":
+            for i, store in enumerate(stores):
+                row = store[0][store[2][fname]]
+                reused[i][fname] = np.array(row) if copy_rows else row
+        else:
+            to_compute.append(fname)
+    counts["removed"] = len(known.difference(files))
+    return reused, to_compute, fingerprints, counts
+
+
+def count_failures(
+    counts: Dict[str, int], failed: List[str], statuses: Dict[str, str]
+) -> None:
+    """Move the files that could not be decoded from their status to ``failed``.
+
+    ``statuses`` comes from ``plan_incremental_update``; files it does not
+    list were counted as added.
+    """
+    for fname in failed:
+        counts[statuses.get(fname, "added")] -= 1
+    counts["failed"] = len(failed)
+
+
+# Per-image descriptor extractors: name -> fn(image_bgr, bins, normalize).
+# Each one gets its own store, ``<name>_dictionary.npy``.
+EXTRACTORS: Dict[str, Callable[[np.ndarray, int, bool], np.ndarray]] = {
+    "rgb": compute_rgb_histogram,
+    "hsv": compute_hsv_histogram,
+}
+
+
+def register_extractor(
+    name: str, extract: Callable[[np.ndarray, int, bool], np.ndarray]
+) -> None:
+    """Plug an extra descriptor into ``build_index``.
+
+    ``extract(image_bgr, bins, normalize)`` must return a 1-D vector of the same
+    length for every image. With ``use_processes`` the registration has to
+    happen at import time of a module the worker processes also import.
+    """
+    EXTRACTORS[name] = extract
+
+
+def _extract_descriptors(
+    fpath: str,
+    kinds: Tuple[str, ...],
+    bins: int,
+    normalize: bool,
+    resolution: Optional[Dict[str, Optional[int]]] = None,
+) -> Dict[str, np.ndarray]:
+    # Decode once, then run every extractor on the same pixel buffer
+    img = read_image(fpath, resolution)
+    return {kind: EXTRACTORS[kind](img, bins, normalize) for kind in kinds}
+
+
+@instrumented("indexer.build")
+def build_index(
+    images_dir: str = "images",
+    kinds: Tuple[str, ...] = ("rgb", "hsv"),
+    bins: int = 256,
+    normalize: bool = True,
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    output_dir: Optional[str] = ".",
+    incremental: bool = False,
+    content_hash: bool = False,
+    ann: bool = False,
+    thumbnails: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    resume: bool = True,
+    chunk_rows: int = 1024,
+    store_paths: Optional[Dict[str, str]] = None,
+    stats: QueryStats = NULL_STATS,
+) -> Dict[str, Tuple[List[str], np.ndarray]]:
+    """Build every descriptor in ``kinds`` in a single pass over ``images_dir``.
+
+    Returns ``{kind: (filenames, matrix)}`` and, unless ``output_dir`` is None,
+    writes one binary store per kind into it. With ``incremental`` the
+    existing stores in ``output_dir`` are reused: only new or changed files
+    are decoded and deleted files are dropped (see ``plan_incremental_update``).
+    With ``ann`` the IVF index next to each store is created or updated too,
+    and with ``thumbnails`` the missing result thumbnails are pre-built.
+    ``reduce`` (2, 4 or 8) and ``max_pixels`` lower the descriptor resolution
+    (see ``histogram.descriptor_resolution``); the setting is recorded in the
+    stores and queries follow it.
+
+    Stores are written as the images are processed: rows are appended in
+    blocks of ``chunk_rows`` through a ``histogram_store.StoreWriter``, so
+    memory does not grow with the collection and the returned matrices are
+    memory-mapped from the finished stores. Every block is a checkpoint; with
+    ``resume`` an interrupted build with the same settings carries on from
+    the last one. ``store_paths`` overrides the ``<kind>_dictionary.npy``
+    paths in ``output_dir``. With ``output_dir=None`` nothing is written and
+    the matrices are built in memory. ``stats`` records the plan, extract,
+    write and finalize stages with images decoded, rows reused and bytes read.
+    """
+    unknown = [k for k in kinds if k not in EXTRACTORS]
+    if unknown:
+        raise ValueError(f"Unknown descriptor extractor(s): {', '.join(unknown)}")
+    resolution = descriptor_resolution(reduce, max_pixels)
+    last_index_report.clear()
+    if not os.path.isdir(images_dir):
+        logger.error("Directory not found: %s", images_dir)
+        return {}
+
+    with stats.stage("list"):
+        files = list_image_files(images_dir, extensions)
+    paths = [
+        (store_paths or {}).get(kind)
+        or os.path.join(output_dir or ".", f"{kind}_dictionary.npy")
+        for kind in kinds
+    ]
+    streaming = output_dir is not None
+    statuses: Dict[str, str] = {}
+    with stats.stage("plan"):
+        if incremental and streaming:
+            reused, to_compute, fingerprints, counts = plan_incremental_update(
+                images_dir,
+                files,
+                paths,
+                bins,
+                normalize,
+                content_hash,
+                resolution,
+                copy_rows=False,
+                statuses=statuses,
+            )
+        else:
+            reused = [{} for _ in kinds]
+            to_compute = files
+            fingerprints = {
+                f: file_fingerprint(os.path.join(images_dir, f), content_hash)
+                for f in files
+            }
+            counts = {"added": len(files), "updated": 0, "removed": 0, "unchanged": 0}
+
+    writers: List[StoreWriter] = []
+    done: set = set()
+    if streaming:
+        with stats.stage("resume"):
+            writers = [
+                StoreWriter(
+                    path,
+                    kind,
+                    bins,
+                    normalize,
+                    extra={"resolution": resolution},
+                    chunk_rows=chunk_rows,
+                    resume=resume,
+                )
+                for kind, path in zip(kinds, paths)
+            ]
+            # Stores are checkpointed one after the other: keep their common prefix
+            resumed = min(len(w.filenames) for w in writers)
+            for w in writers:
+                w.truncate(resumed)
+            done = set(writers[0].filenames)
+            # Rows cannot be taken out of the middle of a partial store: if a
+            # checkpointed file changed or disappeared since, start over
+            if any(writers[0].fingerprints[f] != fingerprints.get(f) for f in done):
+                logger.info("Images changed since the last checkpoint; restarting")
+                for w in writers:
+                    w.truncate(0)
+                done = set()
+            elif done:
+                logger.info("Resuming: %d image(s) already indexed", len(done))
+        stats.count("rows_resumed", len(done))
+    filenames: List[str] = []
+    rows: Dict[str, List[np.ndarray]] = {kind: [] for kind in kinds}
+    failed: List[str] = []
+    extract = partial(
+        _extract_descriptors,
+        kinds=kinds,
+        bins=bins,
+        normalize=normalize,
+        resolution=resolution,
+    )
+    computed = map_image_files(
+        images_dir,
+        [f for f in to_compute if f not in done],
+        extract,
+        workers=workers,
+        use_processes=use_processes,
+    )
+    pending = set(to_compute).difference(done)
+    # Merge in filename order; files that failed to decode are left out
+    for fname in files:
+        if fname in done:
+            continue
+        if fname in pending:
+            with stats.stage("extract"):
+                _, descriptors, error = next(computed)
+            if error is not None:
+                logger.warning("Skip '%s': %s", fname, error)
+                failed.append(fname)
+                continue
+            values = [descriptors[kind] for kind in kinds]
+            stats.count("images_decoded")
+            stats.count("bytes_read", fingerprints[fname][0])
+        elif fname in reused[0]:
+            values = [kept.pop(fname) for kept in reused]
+            stats.count("rows_reused")
+        else:
+            continue
+        filenames.append(fname)
+        with stats.stage("write"):
+            if streaming:
+                for w, value in zip(writers, values):
+                    w.append(fname, value, fingerprints[fname])
+            else:
+                for kind, value in zip(kinds, values):
+                    rows[kind].append(value)
+    # Release the old stores' memory maps before replacing them
+    del reused
+    if streaming:
+        # Resumed rows come first, in the order they were checkpointed
+        for w in writers:
+            w.checkpoint()
+        filenames = list(writers[0].filenames)
+
+    results: Dict[str, Tuple[List[str], np.ndarray]] = {}
+    for i, (kind, path) in enumerate(zip(kinds, paths)):
+        if not streaming:
+            matrix = (
+                np.vstack(rows[kind]).astype(np.float32, copy=False)
+                if rows[kind]
+                else np.zeros((0, 0), dtype=np.float32)
+            )
+            results[kind] = (filenames, matrix)
+            continue
+        if writers[i].dim is None:
+            # Nothing left to index: still replace the store, so images that
+            # were removed do not linger in it
+            writers[i].dim = 3 * bins if kind in CHANNELS else 0
+        with stats.stage("finalize"):
+            writers[i].finalize()
+        logger.info("Wrote histogram store to %s", path)
+        results[kind] = (filenames, load_histogram_store(path)[0])
+        if not filenames:
+            # An IVF index cannot be trained on an empty store
+            if os.path.exists(ivf_path(path)):
+                os.remove(ivf_path(path))
+        elif ann:
+            with stats.stage("ann"):
+                ivf = update_ivf_index(path, kind, changed=to_compute)
+            logger.info("Updated IVF index (%d list(s))", ivf.nlist)
+
+    if thumbnails and filenames:
+        from thumbnails import ThumbnailCache
+
+        with stats.stage("thumbnails"):
+            built = ThumbnailCache().warm(images_dir, filenames, workers=workers)
+        logger.info("Built %d thumbnail(s)", built)
+
+    count_failures(counts, failed, statuses)
+    stats.count("failed", len(failed))
+    last_index_report.update(counts)
+    if incremental:
+        logger.info(
+            "Added %d, updated %d, removed %d, unchanged %d, failed %d image(s).",
+            counts["added"],
+            counts["updated"],
+            counts["removed"],
+            counts["unchanged"],
+            counts["failed"],
+        )
+    logger.info(
+        "Indexed %d image(s) into %s, failed %d in '%s'.",
+        len(filenames),
+        ", ".join(kinds),
+        len(failed),
+        images_dir,
+    )
+    return results
+
+
+def _histogram_from_file(
+    fpath: str,
+    color_space: str,
+    bins: int,
+    normalize: bool,
+    resolution: Dict[str, Any],
+) -> np.ndarray:
+    return compute_histogram(
+        read_image(fpath, resolution), color_space, bins, normalize
+    )
+
+
+class HistogramDictionary:
+    """In-memory index of one color space, behind ``rgb_index``/``hsv_index``.
+
+    ``by_filename`` maps filename -> histogram (list of floats), ``by_index``
+    is its 1-based view sorted by filename, ``settings`` holds the options of
+    the last ``build`` and ``fingerprints`` the ``file_fingerprint`` of each
+    indexed file. The dictionaries are only ever updated in place.
+    """
+
+    def __init__(self, color_space: str) -> None:
+        self.color_space = color_space
+        self.by_filename: Dict[str, List[float]] = {}
+        self.by_index: Dict[int, Dict[str, Any]] = {}
+        self.settings: Dict[str, object] = {}
+        self.fingerprints: Dict[str, List[Any]] = {}
+
+    def build(
+        self,
+        images_dir: str = "images",
+        bins: int = 256,
+        normalize: bool = True,
+        extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+        workers: int = 1,
+        use_processes: bool = False,
+        incremental: bool = False,
+        store_path: Optional[str] = None,
+        content_hash: bool = False,
+        reduce: int = 1,
+        max_pixels: Optional[int] = None,
+        stats: QueryStats = NULL_STATS,
+    ) -> Dict[str, List[float]]:
+        """Index ``images_dir``; see ``rgb_index.build_rgb_index``."""
+        self.by_filename.clear()
+        self.by_index.clear()
+        self.settings.clear()
+        self.fingerprints.clear()
+        resolution = descriptor_resolution(reduce, max_pixels)
+        if not os.path.isdir(images_dir):
+            logger.error("Directory not found: %s", images_dir)
+            return self.by_filename
+        self.settings.update(bins=bins, normalize=normalize, resolution=resolution)
+        store_path = store_path or f"{self.color_space}_dictionary.npy"
+
+        files = list_image_files(images_dir, extensions)
+        failed: List[str] = []
+        statuses: Dict[str, str] = {}
+
+        if incremental:
+            with stats.stage("plan"):
+                reused, to_compute, fingerprints, counts = plan_incremental_update(
+                    images_dir,
+                    files,
+                    [store_path],
+                    bins,
+                    normalize,
+                    content_hash,
+                    resolution,
+                    statuses=statuses,
+                )
+            kept = reused[0]
+        else:
+            kept = {}
+            to_compute = files
+            with stats.stage("plan"):
+                fingerprints = {
+                    f: file_fingerprint(os.path.join(images_dir, f), content_hash)
+                    for f in files
+                }
+
+        computed: Dict[str, List[float]] = {}
+        extract = partial(
+            _histogram_from_file,
+            color_space=self.color_space,
+            bins=bins,
+            normalize=normalize,
+            resolution=resolution,
+        )
+        with stats.stage("extract"):
+            for fname, hist, error in map_image_files(
+                images_dir,
+                to_compute,
+                extract,
+                workers=workers,
+                use_processes=use_processes,
+            ):
+                if error is not None:
+                    logger.warning("Skip '%s': %s", fname, error)
+                    failed.append(fname)
+                    continue
+                computed[fname] = hist.tolist()
+                stats.count("bytes_read", fingerprints[fname][0])
+        stats.count("images_decoded", len(computed))
+        stats.count("rows_reused", len(kept))
+        stats.count("failed", len(failed))
+        if incremental:
+            count_failures(counts, failed, statuses)
+            logger.info(
+                "Added %d, updated %d, removed %d, unchanged %d, failed %d image(s).",
+                counts["added"],
+                counts["updated"],
+                counts["removed"],
+                counts["unchanged"],
+                counts["failed"],
+            )
+
+        with stats.stage("merge"):
+            for fname in files:
+                if fname in computed:
+                    self.by_filename[fname] = computed[fname]
+                elif fname in kept:
+                    self.by_filename[fname] = kept[fname].tolist()
+                else:
+                    continue
+                self.fingerprints[fname] = fingerprints[fname]
+
+            # Build stable indexed view (sorted by filename for determinism)
+            for idx, fname in enumerate(sorted(self.by_filename.keys()), start=1):
+                self.by_index[idx] = {
+                    "filename": fname,
+                    "histogram": self.by_filename[fname],
+                }
+
+        logger.info(
+            "Indexed %d image(s), failed %d in '%s'.",
+            len(self.by_filename),
+            len(failed),
+            images_dir,
+        )
+        return self.by_filename
+
+    def save_store(self, file_path: str) -> None:
+        """Save the index as a float32 ``.npy`` matrix plus a ``.meta.json`` sidecar.
+
+        After a build that left no image (e.g. all of them were deleted) an
+        empty store is written, so the old rows do not survive.
+        """
+        if not self.by_filename and not self.settings:
+            logger.warning(
+                "Nothing to save: %s_dictionary is empty. Build the index first.",
+                self.color_space,
+            )
+            return
+        filenames = sorted(self.by_filename.keys())
+        matrix = np.asarray([self.by_filename[f] for f in filenames], dtype=np.float32)
+        if not filenames:
+            matrix = np.zeros((0, 3 * self.settings["bins"]), dtype=np.float32)
+        fingerprints = {
+            f: self.fingerprints[f] for f in filenames if f in self.fingerprints
+        }
+        save_histogram_store(
+            file_path,
+            filenames,
+            matrix,
+            color_space=self.color_space,
+            bins=self.settings.get("bins", matrix.shape[1] // 3),
+            normalize=self.settings.get("normalize", True),
+            extra={
+                "fingerprints": fingerprints,
+                "resolution": self.settings.get("resolution", FULL_RESOLUTION),
+            },
+        )
+        logger.info("Wrote histogram store to %s", file_path)
+
+    def save_json(self, file_path: str) -> None:
+        """Export both filename-keyed and indexed dictionaries to a (legacy) JSON file."""
+        if not self.by_filename:
+            logger.warning(
+                "Nothing to save: %s_dictionary is empty. Build the index first.",
+                self.color_space,
+            )
+            return
+        payload = {
+            "by_filename": self.by_filename,
+            "by_index": self.by_index,
+        }
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        logger.info("Wrote JSON dictionary to %s", file_path)
+
+
+def build_store(
+    images_dir: str,
+    color_space: str,
+    store_path: str,
+    bins: int = 256,
+    normalize: bool = True,
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    incremental: bool = False,
+    content_hash: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    resume: bool = True,
+    chunk_rows: int = 1024,
+    stats: Optional[QueryStats] = None,
+) -> int:
+    """Stream one color space into ``store_path`` with ``build_index``.
+
+    Returns the number of indexed images.
+    """
+    results = build_index(
+        images_dir,
+        kinds=(color_space,),
+        bins=bins,
+        normalize=normalize,
+        extensions=extensions,
+        workers=workers,
+        use_processes=use_processes,
+        incremental=incremental,
+        content_hash=content_hash,
+        reduce=reduce,
+        max_pixels=max_pixels,
+        resume=resume,
+        chunk_rows=chunk_rows,
+        store_paths={color_space: store_path},
+        stats=stats,
+    )
+    return len(results[color_space][0]) if results else 0
+
+
+def measure_resolution_agreement(
+    images_dir: str = "images",
+    kind: str = "rgb",
+    reduce: int = 4,
+    max_pixels: Optional[int] = None,
+    bins: int = 256,
+    metric: str = "bhattacharyya",
+    top_k: int = 10,
+    workers: int = 1,
+) -> Dict[str, float]:
+    """Compare a reduced descriptor resolution against full resolution.
+
+    Every image is used as a query, once against a full-resolution index and
+    once with query and index both at the reduced resolution. Returns the
+    mean overlap of the two top-k lists, the fraction of queries whose best
+    other match is unchanged and the mean distance between each image's full
+    and reduced descriptors.
+    """
+    full = build_index(images_dir, (kind,), bins, workers=workers, output_dir=None)
+    reduced = build_index(
+        images_dir,
+        (kind,),
+        bins,
+        workers=workers,
+        output_dir=None,
+        reduce=reduce,
+        max_pixels=max_pixels,
+    )
+    names, full_matrix = full[kind]
+    reduced_names, reduced_matrix = reduced[kind]
+    if names != reduced_names or not names:
+        raise ValueError("Both resolutions must index the same, non-empty set of files")
+    full_db = HistogramDatabase("", names, full_matrix)
+    reduced_db = HistogramDatabase("", names, reduced_matrix)
+    d_full = pairwise_distances(full_matrix, full_db, metric, True)
+    d_reduced = pairwise_distances(reduced_matrix, reduced_db, metric, True)
+    overlap = 0.0
+    same_best = 0
+    for i in range(len(names)):
+        # The query itself always ranks first; compare the other matches
+        d_full[i, i] = d_reduced[i, i] = np.inf
+        a = select_top_k(d_full[i], top_k)
+        b = select_top_k(d_reduced[i], top_k)
+        overlap += len(np.intersect1d(a, b)) / len(a) if len(a) else 1.0
+        same_best += int(a[:1].tolist() == b[:1].tolist())
+    self_distance = pairwise_distances(full_matrix, reduced_db, metric, True)
+    return {
+        "images": len(names),
+        "overlap_at_k": overlap / len(names),
+        "same_best_match": same_best / len(names),
+        "mean_descriptor_distance": float(np.mean(np.diag(self_distance))),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+    build_index("images", kinds=("rgb", "hsv"), bins=256, normalize=True)
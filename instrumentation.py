@@ -0,0 +1,269 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# Optional per-stage timing and counters for searches, index builds and the UI.
+# Instrumented functions take a ``stats`` keyword: pass a ``QueryStats`` to
+# have it filled in. Without one, a call is only measured when a callback is
+# registered (``add_callback``) or metric collection is on (``enable_metrics``);
+# otherwise it records into ``NULL_STATS``, which does nothing. Nested
+# instrumented calls add to their caller's stats, which is published once,
+# when the outermost call returns.
+#
+# Common counters: rows_scanned, candidates_scored, cache_hits, cache_misses,
+# bytes_read. Stage and counter names are free-form strings.
+METRIC_PREFIX = "image_search"
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class QueryStats:
+    """Wall time per stage and counters of one operation; safe across threads."""
+
+    def __init__(self, operation: str = "") -> None:
+        self.operation = operation
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+        self._depth = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self._start
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "operation": self.operation,
+                "seconds": self.seconds,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+            }
+
+    def __repr__(self) -> str:
+        stages = ", ".join(f"{k}={v * 1e3:.2f}ms" for k, v in self.stages.items())
+        counters = ", ".join(f"{k}={v}" for k, v in self.counters.items())
+        return f"QueryStats({self.operation!r}, {stages}; {counters})"
+
+
+class _NullStats(QueryStats):
+    """Accepts every call and records nothing."""
+
+    _NULL_STAGE = contextlib.nullcontext()
+
+    def stage(self, name: str):  # type: ignore[override]
+        return self._NULL_STAGE
+
+    def add_time(self, name: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+
+NULL_STATS: QueryStats = _NullStats()
+
+
+class MetricsRegistry:
+    """Running totals of published stats, rendered in Prometheus text format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._operations: Dict[str, int] = {}
+        self._seconds: Dict[str, float] = {}
+        self._bucket_counts: Dict[str, List[int]] = {}
+        self._stage_seconds: Dict[Tuple[str, str], float] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stats: QueryStats) -> None:
+        op = stats.operation
+        with self._lock:
+            self._operations[op] = self._operations.get(op, 0) + 1
+            self._seconds[op] = self._seconds.get(op, 0.0) + stats.seconds
+            counts = self._bucket_counts.setdefault(op, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if stats.seconds <= bound:
+                    counts[i] += 1
+            for name, seconds in stats.stages.items():
+                key = (op, name)
+                self._stage_seconds[key] = self._stage_seconds.get(key, 0.0) + seconds
+            for name, n in stats.counters.items():
+                key = (op, name)
+                self._counters[key] = self._counters.get(key, 0) + n
+
+    def clear(self) -> None:
+        with self._lock:
+            self._operations.clear()
+            self._seconds.clear()
+            self._bucket_counts.clear()
+            self._stage_seconds.clear()
+            self._counters.clear()
+
+    def prometheus_text(self) -> str:
+        p = METRIC_PREFIX
+        lines: List[str] = []
+        with self._lock:
+            lines += [
+                f"# HELP {p}_operation_seconds Wall time of instrumented operations.",
+                f"# TYPE {p}_operation_seconds histogram",
+            ]
+            for op in sorted(self._operations):
+                label = f'operation="{_escape(op)}"'
+                for bound, n in zip(self.buckets, self._bucket_counts[op]):
+                    lines.append(
+                        f'{p}_operation_seconds_bucket{{{label},le="{bound}"}} {n}'
+                    )
+                lines.append(
+                    f'{p}_operation_seconds_bucket{{{label},le="+Inf"}} '
+                    f"{self._operations[op]}"
+                )
+                lines.append(
+                    f"{p}_operation_seconds_sum{{{label}}} {self._seconds[op]}"
+                )
+                lines.append(
+                    f"{p}_operation_seconds_count{{{label}}} {self._operations[op]}"
+                )
+            lines += [
+                f"# HELP {p}_stage_seconds_total Wall time spent in each stage.",
+                f"# TYPE {p}_stage_seconds_total counter",
+            ]
+            for (op, name), seconds in sorted(self._stage_seconds.items()):
+                lines.append(
+                    f'{p}_stage_seconds_total{{operation="{_escape(op)}",'
+                    f'stage="{_escape(name)}"}} {seconds}'
+                )
+            lines += [
+                f"# HELP {p}_events_total Counters reported by operations.",
+                f"# TYPE {p}_events_total counter",
+            ]
+            for (op, name), n in sorted(self._counters.items()):
+                lines.append(
+                    f'{p}_events_total{{operation="{_escape(op)}",'
+                    f'event="{_escape(name)}"}} {n}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+_metrics_enabled = False
+_callbacks: List[Callable[[QueryStats], None]] = []
+
+
+def add_callback(callback: Callable[[QueryStats], None]) -> None:
+    """Call ``callback(stats)`` after every instrumented operation."""
+    _callbacks.append(callback)
+
+
+def remove_callback(callback: Callable[[QueryStats], None]) -> None:
+    if callback in _callbacks:
+        _callbacks.remove(callback)
+
+
+def enable_metrics(enabled: bool = True) -> None:
+    """Aggregate every operation into ``registry`` (see ``prometheus_text``)."""
+    global _metrics_enabled
+    _metrics_enabled = enabled
+
+
+def is_active() -> bool:
+    return _metrics_enabled or bool(_callbacks)
+
+
+def begin(operation: str, stats: Optional[QueryStats] = None) -> QueryStats:
+    """Stats to record ``operation`` into: ``stats`` itself, a new one or ``NULL_STATS``."""
+    if stats is None:
+        if not is_active():
+            return NULL_STATS
+        stats = QueryStats(operation)
+    if stats is NULL_STATS:
+        return stats
+    if not stats.operation:
+        stats.operation = operation
+    if stats._depth == 0:
+        # Outermost call: time it from here, also when ``stats`` is reused
+        stats._start = time.perf_counter()
+    stats._depth += 1
+    return stats
+
+
+def end(stats: QueryStats) -> None:
+    """Close ``stats``; the outermost ``end`` publishes it."""
+    if stats is NULL_STATS:
+        return
+    stats._depth -= 1
+    if stats._depth > 0:
+        return
+    stats.finish()
+    if _metrics_enabled:
+        registry.observe(stats)
+    for callback in list(_callbacks):
+        callback(stats)
+
+
+def instrumented(operation: str) -> Callable:
+    """Decorator: run the function with ``stats=begin(operation, stats)``."""
+
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, stats: Optional[QueryStats] = None, **kwargs: Any):
+            stats = begin(operation, stats)
+            try:
+                return fn(*args, stats=stats, **kwargs)
+            finally:
+                end(stats)
+
+        return wrapper
+
+    return decorate
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
+
+
+def write_prometheus(path: str) -> None:
+    """Write ``registry`` atomically, e.g. for node_exporter's textfile collector."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
@@ -1,11 +1,228 @@
 import tkinter as tk
 from tkinter import messagebox, filedialog
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import os
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
 from boolean import search_images as boolean_search_images
+from thumbnails import ThumbnailCache, thumbnail_key
 from vectorielle import search_images as vector_search_images
 
 
+class BackgroundTasks:
+    """Runs work on a thread pool and hands the results back to the Tk loop.
+
+    Tk widgets may only be touched from the main thread, so workers push
+    ``(generation, task, callbacks, result, error)`` onto a queue drained by
+    a ``root.after`` poll. Every task belongs to a generation; starting a new
+    generation cancels the tasks that have not started yet and drops the
+    results of those still running; ``cancel`` does the same for one task.
+    A task's ``on_drop`` runs, on the Tk thread, once it is known that its
+    ``on_done`` never will.
+    """
+
+    def __init__(self, root, workers=4, poll_ms=30, budget_ms=15):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.budget_ms = budget_ms
+        self.generation = 0
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="iri-ui"
+        )
+        self._results = queue.SimpleQueue()
+        # (future, on_drop, token) of the tasks submitted in this generation
+        self._futures = []
+        # Tokens of cancelled tasks whose result is still to be dropped
+        self._dropped = set()
+        self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def new_generation(self):
+        """Supersede every pending task; returns the new generation."""
+        self.generation += 1
+        for future, on_drop, _ in self._futures:
+            # Tasks already running report back through the queue instead
+            if future.cancel() and on_drop is not None:
+                on_drop()
+        self._futures.clear()
+        return self.generation
+
+    def cancel(self, future):
+        """Supersede the single task behind ``future``, leaving the others."""
+        for i, (f, on_drop, token) in enumerate(self._futures):
+            if f is future:
+                del self._futures[i]
+                if future.cancel():
+                    if on_drop is not None:
+                        on_drop()
+                else:
+                    self._dropped.add(token)
+                return
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def submit(self, generation, fn, on_done, *args, on_drop=None):
+        """Run ``fn(*args)`` on a worker; ``on_done(result, error)`` runs on the
+        Tk thread if ``generation`` is still current by then, ``on_drop()``
+        otherwise."""
+
+        token = object()
+
+        def run():
+            result = error = None
+            if self.is_current(generation) and token not in self._dropped:
+                try:
+                    result = fn(*args)
+                except Exception as e:
+                    error = e
+            self._results.put((generation, token, on_done, on_drop, result, error))
+
+        self._futures = [t for t in self._futures if not t[0].done()]
+        future = self._pool.submit(run)
+        self._futures.append((future, on_drop, token))
+        return future
+
+    def _poll(self):
+        # Bounded slice per tick so a burst of results cannot freeze the UI
+        deadline = time.monotonic() + self.budget_ms / 1000
+        while time.monotonic() < deadline:
+            try:
+                generation, token, on_done, on_drop, result, error = (
+                    self._results.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if self.is_current(generation) and token not in self._dropped:
+                on_done(result, error)
+            else:
+                self._dropped.discard(token)
+                if on_drop is not None:
+                    on_drop()
+        self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        self.new_generation()
+        self.root.after_cancel(self._poll_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_search(method, query, image_path, top_k, stats=instrumentation.NULL_STATS):
+    """Run one search; returns ``(result_images, scores)``. Safe off the Tk thread."""
+    with stats.stage("search"):
+        return _run_search(method, query, image_path, top_k, stats)
+
+
+def _run_search(method, query, image_path, top_k, stats):
+    if method == "vectorielle":
+        # vectorielle returns (sorted_images, cosine_scores)
+        return vector_search_images(query, top_k=top_k, stats=stats)
+    if method == "boolean":
+        # boolean returns list of image filenames
+        return boolean_search_images(query, top_k=top_k, stats=stats), None
+    if method == "hist_rgb":
+        from histogram import search_images_by_histogram
+
+        # For display, distances are passed as 'scores'
+        return search_images_by_histogram(
+            image_path,
+            db_json_path="rgb_dictionary.npy",
+            bins=256,
+            normalize=True,
+            metric="bhattacharyya",
+            top_k=top_k,
+            stats=stats,
+        )
+    if method == "hist_hsv":
+        from histogram import search_images_by_hsv_histogram
+
+        return search_images_by_hsv_histogram(
+            image_path,
+            db_json_path="hsv_dictionary.npy",
+            bins=256,
+            normalize=True,
+            metric="bhattacharyya",
+            top_k=top_k,
+            stats=stats,
+        )
+    return [], None
+
+
+class PhotoCache:
+    """LRU of Tk ``PhotoImage``s keyed by ``thumbnail_key``; Tk thread only."""
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self._photos = OrderedDict()
+
+    def get(self, key):
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+        return photo
+
+    def put(self, key, photo):
+        self._photos[key] = photo
+        self._photos.move_to_end(key)
+        while len(self._photos) > self.capacity:
+            self._photos.popitem(last=False)
+
+
+# Result grid geometry (pixels); every tile has the same size
+CELL_WIDTH = 270
+CELL_HEIGHT = 330
+# Rows kept alive above and below the viewport
+OVERSCAN_ROWS = 1
+
+
+class ResultCell:
+    """A recyclable result tile: a fixed-size frame, thumbnail and caption."""
+
+    def __init__(self, app):
+        self.frame = tk.Frame(
+            app.canvas,
+            width=CELL_WIDTH - 20,
+            height=CELL_HEIGHT - 20,
+            bg=app.bg_color,
+            relief=tk.RIDGE,
+            borderwidth=2,
+        )
+        self.frame.pack_propagate(False)
+        # Caption packed first so a long filename is never clipped
+        self.name_label = tk.Label(
+            self.frame,
+            font=("Arial", 12),
+            bg=app.bg_color,
+            fg=app.fg_color,
+            wraplength=CELL_WIDTH - 40,
+        )
+        self.name_label.pack(side=tk.BOTTOM, pady=(0, 5))
+        self.img_label = tk.Label(
+            self.frame, font=("Arial", 12), bg=app.bg_color, fg=app.fg_color
+        )
+        self.img_label.pack(padx=5, pady=5, expand=True)
+        self.window = app.canvas.create_window(
+            -CELL_WIDTH, -CELL_HEIGHT, window=self.frame, anchor="nw"
+        )
+        self.index = None
+        self.filename = None
+        # Thumbnail key of the file shown; tells late thumbnails apart
+        self.key = None
+        # Keeps the shown PhotoImage alive even once evicted from the LRU
+        self.photo = None
+        self.future = None
+
+    def show_placeholder(self, text, fg):
+        self.photo = None
+        self.img_label.config(image="", text=text, fg=fg)
+
+    def show_photo(self, photo):
+        self.photo = photo
+        self.img_label.config(image=photo, text="")
+
+
 class ImageSearchApp:
     def __init__(self, root):
         self.bg_color = "#201F1F"
@@ -17,7 +234,27 @@ class ImageSearchApp:
         self.root.geometry("1280x720")
         self.root.configure(bg=self.bg_color)
         self.images_path = "images/"
-        self.photo_references = []
+        # Ranked searches fetch this many results per page ("Load more" adds one)
+        self.max_results = 100
+        self.results = []
+        self.scores = None
+        self.requested = 0
+        # top-k of the results on screen, restored when "Load more" is cancelled
+        self.previous_requested = 0
+        # Future of the running search, if any
+        self.search_future = None
+        self.last_search = None
+        # instrumentation.QueryStats of the last completed search, if recorded
+        self.last_stats = None
+        # Tiles by result index for the visible rows, and recycled ones
+        self.cells = {}
+        self.spare_cells = []
+        # Searches and thumbnail decoding run off the Tk thread
+        self.tasks = BackgroundTasks(root)
+        # Thumbnails: pre-scaled copies on disk, recent PhotoImages in memory
+        self.thumbnail_cache = ThumbnailCache()
+        self.photo_cache = PhotoCache()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         title_label = tk.Label(
             root,
@@ -54,6 +291,18 @@ class ImageSearchApp:
         )
         self.search_button.pack(side=tk.LEFT, padx=5)
 
+        self.cancel_button = tk.Button(
+            search_frame,
+            text="Cancel",
+            font=self.small_font,
+            command=self.cancel_search,
+            bg="#3A3A3A",
+            fg=self.fg_color,
+            relief=tk.RAISED,
+            state=tk.DISABLED,
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
         # Method selector (Boolean | Vectorielle | Histogram RGB/HSV)
         method_frame = tk.Frame(root, bg=self.bg_color)
         method_frame.pack(pady=5)
@@ -137,14 +386,29 @@ class ImageSearchApp:
         # Toggle choose button when method changes
         self.method_var.trace_add("write", lambda *args: self._on_method_change())
 
+        results_frame = tk.Frame(root, bg=self.bg_color)
+        results_frame.pack(pady=5)
+
         self.results_label = tk.Label(
-            root,
+            results_frame,
             text="",
             font=self.small_font,
             bg=self.bg_color,
             fg=self.fg_color,
         )
-        self.results_label.pack(pady=5)
+        self.results_label.pack(side=tk.LEFT, padx=5)
+
+        self.load_more_button = tk.Button(
+            results_frame,
+            text="Load more",
+            font=self.small_font,
+            command=self.load_more,
+            bg="#3A3A3A",
+            fg=self.fg_color,
+            relief=tk.RAISED,
+            state=tk.DISABLED,
+        )
+        self.load_more_button.pack(side=tk.LEFT, padx=5)
 
         canvas_frame = tk.Frame(root, bg=self.bg_color)
         canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -152,32 +416,33 @@ class ImageSearchApp:
         self.scrollbar = tk.Scrollbar(canvas_frame)
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # Virtualized grid: only the visible rows (plus overscan) have tiles,
+        # placed directly on the canvas and recycled while scrolling
         self.canvas = tk.Canvas(
             canvas_frame,
             bg=self.bg_color,
-            yscrollcommand=self.scrollbar.set,
+            yscrollcommand=self.on_yscroll,
+            yscrollincrement=CELL_HEIGHT // 4,
             highlightthickness=0,
         )
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         self.scrollbar.config(command=self.canvas.yview)
 
-        self.images_frame = tk.Frame(self.canvas, bg=self.bg_color)
-        self.canvas_window = self.canvas.create_window(
-            (0, 0), window=self.images_frame, anchor="nw"
-        )
-
         self.canvas.bind("<Configure>", self.on_canvas_configure)
-        self.images_frame.bind("<Configure>", self.on_frame_configure)
         self.canvas.bind_all("<MouseWheel>", self.on_mousewheel)
         self.canvas.bind_all("<Button-4>", self.on_mousewheel)
         self.canvas.bind_all("<Button-5>", self.on_mousewheel)
 
     def on_canvas_configure(self, event):
-        self.canvas.itemconfig(self.canvas_window, width=event.width)
+        # Column count may have changed: lay every tile out again
+        for index in list(self.cells):
+            self.release_cell(index)
+        self.layout_grid()
 
-    def on_frame_configure(self, event):
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+    def on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh_visible()
 
     def on_mousewheel(self, event):
         if event.num == 4 or event.delta > 0:
@@ -208,6 +473,10 @@ class ImageSearchApp:
                 text=f"Selected: {os.path.basename(path)}", fg=self.fg_color
             )
 
+    def on_close(self):
+        self.tasks.shutdown()
+        self.root.destroy()
+
     def perform_search(self):
         method = self.method_var.get()
         query = self.search_entry.get().strip()
@@ -215,52 +484,86 @@ class ImageSearchApp:
         if method in ("boolean", "vectorielle") and not query:
             messagebox.showwarning("Empty Search", "Please enter search keywords!")
             return
+        # histogram methods ignore textual query; use selected image
+        if method in ("hist_rgb", "hist_hsv") and not self.selected_hist_image:
+            messagebox.showwarning(
+                "Histogram", "Please choose an image for histogram search."
+            )
+            return
 
+        # A new search supersedes the running one and its pending thumbnails
         self.clear_results()
-        scores = None
-        if method == "vectorielle":
-            # vectorielle returns (sorted_images, cosine_scores)
-            result_images, scores = vector_search_images(query)
-        elif method == "boolean":
-            # boolean returns list of image filenames
-            result_images = boolean_search_images(query)
-        elif method in ("hist_rgb", "hist_hsv"):
-            # histogram methods ignore textual query; use selected image
-            if not self.selected_hist_image:
-                messagebox.showwarning(
-                    "Histogram", "Please choose an image for histogram search."
-                )
-                return
-            try:
-                if method == "hist_rgb":
-                    from histogram import search_images_by_histogram
-
-                    result_images, distances = search_images_by_histogram(
-                        self.selected_hist_image,
-                        db_json_path="rgb_dictionary.json",
-                        bins=256,
-                        normalize=True,
-                        metric="bhattacharyya",
-                    )
-                else:
-                    from histogram import search_images_by_hsv_histogram
-
-                    result_images, distances = search_images_by_hsv_histogram(
-                        self.selected_hist_image,
-                        db_json_path="hsv_dictionary.json",
-                        bins=256,
-                        normalize=True,
-                        metric="bhattacharyya",
-                    )
-                # For display, pass distances as 'scores'
-                scores = distances
-            except Exception as e:
+        self.last_search = (method, query, self.selected_hist_image)
+        self.results_label.config(text="Searching...", fg=self.fg_color)
+        self.start_search(self.max_results)
+
+    def load_more(self):
+        # Same search with a larger top-k; the ranking prefix is unchanged,
+        # so the tiles already shown stay in place
+        self.load_more_button.config(state=tk.DISABLED)
+        self.start_search(self.requested + self.max_results)
+
+    def start_search(self, top_k):
+        method, query, image_path = self.last_search
+        self.previous_requested = self.requested
+        self.requested = top_k
+        self.cancel_button.config(state=tk.NORMAL)
+        # Covers the search on the worker and the grid update on the Tk thread
+        stats = instrumentation.begin("interface.search")
+        self.search_future = self.tasks.submit(
+            self.tasks.generation,
+            run_search,
+            lambda result, error: self.on_search_done(
+                method, query, result, error, stats
+            ),
+            method,
+            query,
+            image_path,
+            top_k,
+            stats,
+            on_drop=lambda: self.on_search_dropped(stats),
+        )
+
+    def cancel_search(self):
+        # Only the search: thumbnails of the tiles already shown keep loading
+        if self.search_future is not None:
+            self.tasks.cancel(self.search_future)
+            self.search_future = None
+        self.requested = self.previous_requested
+        more = bool(self.results) and len(self.results) >= self.requested
+        self.cancel_button.config(state=tk.DISABLED)
+        self.load_more_button.config(state=tk.NORMAL if more else tk.DISABLED)
+        self.results_label.config(text="Search cancelled", fg=self.fg_color)
+
+    def on_search_done(
+        self, method, query, result, error, stats=instrumentation.NULL_STATS
+    ):
+        self.search_future = None
+        try:
+            with stats.stage("display"):
+                self.show_search_result(method, query, result, error)
+        finally:
+            instrumentation.end(stats)
+            if stats is not instrumentation.NULL_STATS:
+                self.last_stats = stats
+
+    def on_search_dropped(self, stats):
+        # Cancelled or superseded: the worker is done with ``stats``, close it
+        stats.count("cancelled")
+        instrumentation.end(stats)
+
+    def show_search_result(self, method, query, result, error):
+        self.cancel_button.config(state=tk.DISABLED)
+        if error is not None:
+            self.results_label.config(text="", fg=self.fg_color)
+            if method in ("hist_rgb", "hist_hsv"):
                 messagebox.showerror(
-                    "Histogram", f"Error while searching by histogram:\n{e}"
+                    "Histogram", f"Error while searching by histogram:\n{error}"
                 )
-                return
-        else:
-            result_images = []
+            else:
+                messagebox.showerror("Search", f"Error while searching:\n{error}")
+            return
+        result_images, scores = result
 
         if not result_images:
             if method in ("hist_rgb", "hist_hsv"):
@@ -278,68 +581,133 @@ class ImageSearchApp:
                 suffix = (
                     " (histogram RGB)" if method == "hist_rgb" else " (histogram HSV)"
                 )
-            self.results_label.config(
-                text=f"Found {len(result_images)} image(s)" + suffix, fg=self.fg_color
-            )
+            more = len(result_images) >= self.requested
+            if more:
+                found = f"Showing top {len(result_images)} image(s)"
+            else:
+                found = f"Found {len(result_images)} image(s)"
+            self.results_label.config(text=found + suffix, fg=self.fg_color)
+            self.load_more_button.config(state=tk.NORMAL if more else tk.DISABLED)
             self.display_images(result_images, scores)
 
     def clear_results(self):
-        for widget in self.images_frame.winfo_children():
-            widget.destroy()
-        self.photo_references.clear()
+        self.tasks.new_generation()
+        self.search_future = None
+        for index in list(self.cells):
+            self.release_cell(index)
+        self.results = []
+        self.scores = None
+        self.load_more_button.config(state=tk.DISABLED)
+        self.layout_grid()
         self.canvas.yview_moveto(0)
 
     def display_images(self, image_filenames, scores=None):
-        columns = int(self.root.winfo_width() / 270)
-        max_width = 250
-        max_height = 250
-
-        for idx, filename in enumerate(image_filenames):
-            row = idx // columns
-            col = idx % columns
-
-            full_path = os.path.join(self.images_path, filename)
-            img_frame = tk.Frame(
-                self.images_frame, bg=self.bg_color, relief=tk.RIDGE, borderwidth=2
-            )
-            img_frame.grid(row=row, column=col, padx=10, pady=10)
+        # Tiles are only created for the visible rows, see refresh_visible
+        self.results = list(image_filenames)
+        self.scores = scores
+        for index, cell in list(self.cells.items()):
+            # A longer ranking keeps its prefix; anything else is redrawn
+            if index >= len(self.results) or cell.filename != self.results[index]:
+                self.release_cell(index)
+        self.layout_grid()
+
+    def grid_columns(self):
+        return max(1, self.canvas.winfo_width() // CELL_WIDTH)
+
+    def layout_grid(self):
+        columns = self.grid_columns()
+        rows = -(-len(self.results) // columns)
+        self.canvas.configure(
+            scrollregion=(0, 0, self.canvas.winfo_width(), rows * CELL_HEIGHT)
+        )
+        self.refresh_visible()
+
+    def refresh_visible(self):
+        columns = self.grid_columns()
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // CELL_HEIGHT) - OVERSCAN_ROWS)
+        last_row = (
+            int((top + self.canvas.winfo_height()) // CELL_HEIGHT) + OVERSCAN_ROWS
+        )
+        wanted = range(
+            first_row * columns, min(len(self.results), (last_row + 1) * columns)
+        )
+        for index in list(self.cells):
+            if index not in wanted:
+                self.release_cell(index)
+        for index in wanted:
+            if index not in self.cells:
+                self.bind_cell(index, columns)
+
+    def release_cell(self, index):
+        cell = self.cells.pop(index)
+        if cell.future is not None:
+            cell.future.cancel()
+            cell.future = None
+        cell.index = None
+        cell.key = None
+        cell.photo = None
+        self.canvas.coords(cell.window, -CELL_WIDTH, -CELL_HEIGHT)
+        self.spare_cells.append(cell)
+
+    def bind_cell(self, index, columns):
+        cell = self.spare_cells.pop() if self.spare_cells else ResultCell(self)
+        self.cells[index] = cell
+        cell.index = index
+        filename = self.results[index]
+        cell.filename = filename
+        row, col = divmod(index, columns)
+        x_offset = max(0, (self.canvas.winfo_width() - columns * CELL_WIDTH) // 2)
+        self.canvas.coords(
+            cell.window, x_offset + col * CELL_WIDTH + 10, row * CELL_HEIGHT + 10
+        )
 
-            try:
-                img = Image.open(full_path)
-                img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-
-                photo = ImageTk.PhotoImage(img)
-                self.photo_references.append(photo)
-
-                img_label = tk.Label(img_frame, image=photo, bg=self.bg_color)
-                img_label.pack(padx=5, pady=5)
-
-                # Build label text; include score if provided
-                label_text = filename
-                if scores is not None and filename in scores:
-                    label_text = f"{filename}  ({scores[filename]:.4f})"
-
-                name_label = tk.Label(
-                    img_frame,
-                    text=label_text,
-                    font=("Arial", 12),
-                    bg=self.bg_color,
-                    fg=self.fg_color,
-                    wraplength=max_width,
-                )
-                name_label.pack(pady=(0, 5))
-            except Exception:
-                error_label = tk.Label(
-                    img_frame,
-                    text=f"Error: {filename}",
-                    font=("Arial", 12),
-                    bg=self.bg_color,
-                    fg="red",
-                )
-                error_label.pack(padx=10, pady=10)
+        # Build label text; include score if provided
+        label_text = filename
+        if self.scores is not None and filename in self.scores:
+            label_text = f"{filename}  ({self.scores[filename]:.4f})"
+        cell.name_label.config(text=label_text)
+
+        full_path = os.path.join(self.images_path, filename)
+        try:
+            key = thumbnail_key(full_path)
+        except OSError as e:
+            cell.key = None
+            self.on_thumbnail(cell, None, None, e)
+            return
+        cell.key = key
+        photo = self.photo_cache.get(key)
+        if photo is not None:
+            cell.show_photo(photo)
+            return
+        # Placeholder until the worker has decoded the thumbnail
+        cell.show_placeholder("Loading...", self.fg_color)
+        cell.future = self.tasks.submit(
+            self.tasks.generation,
+            self.thumbnail_cache.get,
+            lambda img, error, cell=cell, key=key: (
+                self.on_thumbnail(cell, key, img, error)
+            ),
+            full_path,
+            key,
+        )
 
-        for col in range(columns):
-            self.images_frame.grid_columnconfigure(col, weight=1)
+    def on_thumbnail(self, cell, key, img, error):
+        if error is not None:
+            if cell.key == key:
+                cell.show_placeholder(f"Error: {cell.filename}", "red")
+            return
+        stats = instrumentation.begin("interface.thumbnail")
+        with stats.stage("photo"):
+            photo = ImageTk.PhotoImage(img)
+        instrumentation.end(stats)
+        self.photo_cache.put(key, photo)
+        # The tile may have been recycled for another file meanwhile; then its
+        # future belongs to the new file and is left alone
+        if cell.key == key:
+            if cell.future is not None and cell.future.done():
+                cell.future = None
+            cell.show_photo(photo)
 
 
 def main():
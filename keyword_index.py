@@ -0,0 +1,140 @@
+import math
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Tuple
+
+import numpy as np
+
+
+class InvertedIndex:
+    """Keyword -> posting list of image ids, built once from a keyword dictionary.
+
+    Image ids are positions in the dictionary's iteration order, so sorted
+    posting lists give results in the same order as a scan of the dictionary.
+    """
+
+    def __init__(self, dictionnaire: Mapping[str, Mapping[str, float]]) -> None:
+        self.images: List[str] = list(dictionnaire)
+        postings: Dict[str, List[int]] = {}
+        for image_id, image in enumerate(self.images):
+            for mot in dictionnaire[image]:
+                postings.setdefault(mot, []).append(image_id)
+        self.postings = postings
+        # Membership views used to intersect against the shortest list
+        self._sets: Dict[str, FrozenSet[int]] = {
+            mot: frozenset(ids) for mot, ids in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def postings_for(self, mot: str) -> List[int]:
+        return self.postings.get(mot, [])
+
+    def match_all(self, mots: Iterable[str]) -> List[int]:
+        """Ids of the images having every keyword (AND), smallest list first."""
+        mots = sorted(set(mots), key=lambda m: len(self.postings_for(m)))
+        if not mots:
+            return list(range(len(self.images)))
+        result = self.postings_for(mots[0])
+        for mot in mots[1:]:
+            if not result:
+                break
+            members = self._sets.get(mot, frozenset())
+            result = [i for i in result if i in members]
+        return list(result)
+
+    def match_any(self, mots: Iterable[str]) -> List[int]:
+        """Ids of the images having at least one keyword (OR)."""
+        lists = sorted((self.postings_for(m) for m in set(mots)), key=len, reverse=True)
+        if not lists:
+            return []
+        if len(lists) == 1:
+            return list(lists[0])
+        ids = set(lists[0])
+        for ids_mot in lists[1:]:
+            ids.update(ids_mot)
+        return sorted(ids)
+
+    def names(self, ids: Iterable[int]) -> List[str]:
+        return [self.images[i] for i in ids]
+
+
+class VectorSpaceIndex:
+    """Sparse image x term weight matrix, stored column-wise (one column per term).
+
+    For every (image, term) entry the matrix keeps the weight and the rank of
+    the term among the image's features (0 = heaviest, ties in dictionary
+    order). The rank implements the "crop to the n heaviest features" rule of
+    ``vectorielle.crop_features_by_query_length`` without re-sorting features
+    at query time.
+    """
+
+    def __init__(self, dictionnaire: Mapping[str, Mapping[str, float]]) -> None:
+        self.inverted = InvertedIndex(dictionnaire)
+        self.images = self.inverted.images
+        columns: Dict[str, List[Tuple[int, float, int]]] = {}
+        for image_id, image in enumerate(self.images):
+            features = sorted(
+                dictionnaire[image].items(), key=lambda x: x[1], reverse=True
+            )
+            for rank, (mot, poids) in enumerate(features):
+                columns.setdefault(mot, []).append((image_id, poids, rank))
+        # Vocabulary map: term -> column; column c spans ptr[c]:ptr[c + 1]
+        self.vocabulary: Dict[str, int] = {}
+        ptr = [0]
+        image_ids: List[int] = []
+        weights: List[float] = []
+        ranks: List[int] = []
+        for col, (mot, entries) in enumerate(columns.items()):
+            self.vocabulary[mot] = col
+            for image_id, poids, rank in entries:
+                image_ids.append(image_id)
+                weights.append(poids)
+                ranks.append(rank)
+            ptr.append(len(image_ids))
+        self.ptr = np.asarray(ptr, dtype=np.int64)
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.ranks = np.asarray(ranks, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def column(self, mot: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        col = self.vocabulary.get(mot)
+        if col is None:
+            empty = self.image_ids[:0]
+            return empty, self.weights[:0], self.ranks[:0]
+        span = slice(self.ptr[col], self.ptr[col + 1])
+        return self.image_ids[span], self.weights[span], self.ranks[span]
+
+    def cosine_scores(
+        self, evaluation: Mapping[str, float], crop: int, candidates: List[int]
+    ) -> Dict[int, float]:
+        """Cosine similarity of ``candidates`` to the weighted query ``evaluation``.
+
+        Image weights only count for terms among the image's ``crop`` heaviest
+        features; norms are taken over the query's terms, as in
+        ``vectorielle.cosine_similarity``. Returns the positive scores, rounded
+        to 4 decimals, keyed by image id.
+        """
+        n = len(self.images)
+        dot = np.zeros(n, dtype=np.float64)
+        sq = np.zeros(n, dtype=np.float64)
+        norm_query = math.sqrt(sum(q**2 for q in evaluation.values()))
+        if norm_query == 0 or not candidates:
+            return {}
+        for mot, q in evaluation.items():
+            ids, w, r = self.column(mot)
+            keep = r < crop
+            ids, w = ids[keep], w[keep]
+            dot[ids] += q * w
+            sq[ids] += w**2
+        cand = np.asarray(candidates, dtype=np.int64)
+        cand = cand[(dot[cand] > 0) & (sq[cand] > 0)]
+        scores = dot[cand] / (norm_query * np.sqrt(sq[cand]))
+        result = {}
+        for image_id, score in zip(cand.tolist(), scores.tolist()):
+            score = round(score, 4)
+            if score > 0:
+                result[image_id] = score
+        return result
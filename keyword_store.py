@@ -0,0 +1,227 @@
+import argparse
+import os
+import pathlib
+import sqlite3
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from keyword_index import InvertedIndex, VectorSpaceIndex
+from query_cache import LoaderCache
+
+
+# On-disk keyword-weight database shared by the boolean and vectorielle
+# searches. Images keep their insertion order and features their listed order,
+# so rankings match the dictionary literal the store was imported from.
+# Searches never query it term by term: ``load_keywords`` reads the whole store
+# once per change and builds the inverted and vector-space indexes in memory.
+DEFAULT_KEYWORD_DB = "keywords.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS features (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    term TEXT NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (image_id, term)
+);
+-- Searches load the whole store (see load_keywords); postings are never
+-- looked up by term, so stores created with this index drop it
+DROP INDEX IF EXISTS features_term;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+
+class KeywordStore:
+    """SQLite keyword store: image filename -> {term: weight}."""
+
+    def __init__(self, path: str = DEFAULT_KEYWORD_DB, read_only: bool = False) -> None:
+        """Open (and create or migrate) the store; ``read_only`` never writes."""
+        self.path = path
+        if read_only:
+            uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+            self._conn = sqlite3.connect(uri, uri=True)
+            return
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "KeywordStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def version(self) -> int:
+        """Incremented by every change; identifies the store's content."""
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        return int(row[0])
+
+    def _bump_version(self) -> None:
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def dictionary(self) -> Dict[str, Dict[str, float]]:
+        result: Dict[str, Dict[str, float]] = {}
+        for (filename,) in self._conn.execute(
+            "SELECT filename FROM images ORDER BY id"
+        ):
+            result[filename] = {}
+        rows = self._conn.execute(
+            "SELECT i.filename, f.term, f.weight FROM features f "
+            "JOIN images i ON i.id = f.image_id ORDER BY f.image_id, f.position"
+        )
+        for filename, term, weight in rows:
+            result[filename][term] = weight
+        return result
+
+    def add_image(self, filename: str, features: Mapping[str, float]) -> None:
+        """Add an image, or replace the features of an existing one in place."""
+        with self._conn:
+            self._add_image(filename, features)
+            self._bump_version()
+
+    def _add_image(self, filename: str, features: Mapping[str, float]) -> None:
+        row = self._conn.execute(
+            "SELECT id FROM images WHERE filename = ?", (filename,)
+        ).fetchone()
+        if row is None:
+            image_id = self._conn.execute(
+                "INSERT INTO images (filename) VALUES (?)", (filename,)
+            ).lastrowid
+        else:
+            image_id = row[0]
+            self._conn.execute("DELETE FROM features WHERE image_id = ?", (image_id,))
+        self._conn.executemany(
+            "INSERT INTO features (image_id, position, term, weight) VALUES (?, ?, ?, ?)",
+            [
+                (image_id, position, term, float(weight))
+                for position, (term, weight) in enumerate(features.items())
+            ],
+        )
+
+    def remove_image(self, filename: str) -> bool:
+        with self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM images WHERE filename = ?", (filename,)
+            )
+            if cur.rowcount:
+                self._bump_version()
+        return bool(cur.rowcount)
+
+    def import_dictionary(
+        self, dictionnaire: Mapping[str, Mapping[str, float]]
+    ) -> None:
+        with self._conn:
+            for filename, features in dictionnaire.items():
+                self._add_image(filename, features)
+            self._bump_version()
+
+
+class LoadedKeywords:
+    """A snapshot of the keyword store with its search indexes, built on demand."""
+
+    def __init__(
+        self, dictionnaire: Dict[str, Dict[str, float]], version: Tuple[int, int]
+    ) -> None:
+        self.dictionnaire = dictionnaire
+        self.version = version
+        self._inverted: Optional[InvertedIndex] = None
+        self._vector: Optional[VectorSpaceIndex] = None
+
+    @property
+    def vector(self) -> VectorSpaceIndex:
+        if self._vector is None:
+            self._vector = VectorSpaceIndex(self.dictionnaire)
+            self._inverted = self._vector.inverted
+        return self._vector
+
+    @property
+    def inverted(self) -> InvertedIndex:
+        if self._inverted is None:
+            self._inverted = InvertedIndex(self.dictionnaire)
+        return self._inverted
+
+
+# Loaded stores, keyed by absolute path and versioned by mtime
+_loaded = LoaderCache()
+
+
+def load_keywords(path: str = DEFAULT_KEYWORD_DB) -> LoadedKeywords:
+    """Load the keyword store lazily and keep it until the file changes.
+
+    If the store does not exist yet, the legacy ``index.dictionnaire``
+    literal is used instead (run ``keyword_store.py import`` to migrate it).
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime_ns = -1
+
+    def load() -> LoadedKeywords:
+        if mtime_ns < 0:
+            from index import dictionnaire
+
+            return LoadedKeywords(dict(dictionnaire), (0, 0))
+        with KeywordStore(path, read_only=True) as store:
+            return LoadedKeywords(store.dictionary(), (mtime_ns, store.version()))
+
+    return _loaded.get(os.path.abspath(path), mtime_ns, load)
+
+
+def clear_keyword_cache() -> None:
+    _loaded.clear()
+
+
+def _parse_features(pairs: List[str]) -> Dict[str, float]:
+    features: Dict[str, float] = {}
+    for pair in pairs:
+        term, sep, weight = pair.partition("=")
+        if not sep:
+            raise ValueError(f"Expected term=weight, got '{pair}'")
+        features[term.lower()] = float(weight)
+    return features
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the keyword store")
+    parser.add_argument("--db", default=DEFAULT_KEYWORD_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("import", help="import index.dictionnaire into the store")
+    add = sub.add_parser("add", help="add or update an image")
+    add.add_argument("filename")
+    add.add_argument("features", nargs="+", metavar="term=weight")
+    remove = sub.add_parser("remove", help="remove an image")
+    remove.add_argument("filename")
+    sub.add_parser("list", help="list images and their features")
+    args = parser.parse_args()
+
+    with KeywordStore(args.db) as store:
+        if args.command == "import":
+            from index import dictionnaire
+
+            store.import_dictionary(dictionnaire)
+            print(
+                f"[keyword_store] Imported {len(dictionnaire)} image(s) into {args.db}"
+            )
+        elif args.command == "add":
+            store.add_image(args.filename, _parse_features(args.features))
+            print(f"[keyword_store] Saved '{args.filename}'")
+        elif args.command == "remove":
+            if store.remove_image(args.filename):
+                print(f"[keyword_store] Removed '{args.filename}'")
+            else:
+                print(f"[keyword_store] Not found: '{args.filename}'")
+        else:
+            for filename, features in store.dictionary().items():
+                print(f"{filename}: {features}")
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+# Shared LRU of search results for the boolean, vectorielle and histogram
+# searches. An entry is keyed by the index it was computed on (kind + path)
+# and the normalized query parameters, and tagged with the index version
+# (store mtime / keyword store version). Seeing a new version of an index
+# drops every entry computed on the older one.
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 << 20
+
+IndexId = Tuple[str, str]
+
+
+def estimate_size(value: Any) -> int:
+    """Rough in-memory size of a cached result (lists, dicts, tuples of scalars)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+class QueryCache:
+    """Thread-safe LRU bounded by entry count and estimated size."""
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[IndexId, Hashable], Tuple[Any, Any, int]]" = (
+            OrderedDict()
+        )
+        self._versions: Dict[IndexId, Any] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _check_version(self, index: IndexId, version: Any) -> None:
+        if index in self._versions and self._versions[index] != version:
+            self._drop(lambda key: key[0] == index)
+        self._versions[index] = version
+
+    def _drop(self, match) -> None:
+        for key in [key for key in self._entries if match(key)]:
+            self._bytes -= self._entries.pop(key)[2]
+
+    def get(self, index: IndexId, version: Any, params: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._check_version(index, version)
+            entry = self._entries.get((index, params))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((index, params))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, index: IndexId, version: Any, params: Hashable, value: Any) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(index, version)
+            old = self._entries.pop((index, params), None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[(index, params)] = (version, value, size)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def invalidate(
+        self, kind: Optional[str] = None, path: Optional[str] = None
+    ) -> None:
+        """Drop the entries of one index kind and/or path (all entries by default)."""
+        abspath = os.path.abspath(path) if path is not None else None
+        with self._lock:
+            self._drop(
+                lambda key: (kind is None or key[0][0] == kind)
+                and (abspath is None or key[0][1] == abspath)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+
+result_cache = QueryCache()
+# Histograms of query images that are not in a store (see histogram.query_histogram)
+descriptor_cache = QueryCache(max_entries=512, max_bytes=16 << 20)
+
+
+class LoaderCache:
+    """Objects loaded from files, reused until the file's version changes.
+
+    The version is whatever the caller derives from the file (usually its
+    mtime); a different version reloads the object. Loading runs outside the
+    lock, so two threads may both load a changed file and the last one wins.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[Hashable, Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Any, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = load()
+        with self._lock:
+            self._entries[key] = (version, value)
+        return value
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Content digests of query files, reused while (mtime, size) are unchanged
+_digests: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_DIGEST_ENTRIES = 4096
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of a file's content, so a renamed or copied query image still hits."""
+    abspath = os.path.abspath(path)
+    st = os.stat(abspath)
+    with _digest_lock:
+        known = _digests.get(abspath)
+        if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+            _digests.move_to_end(abspath)
+            return known[2]
+    h = hashlib.sha1()
+    with open(abspath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digests[abspath] = (st.st_mtime_ns, st.st_size, digest)
+        while len(_digests) > _DIGEST_ENTRIES:
+            _digests.popitem(last=False)
+    return digest
+
+
+def array_digest(arr: np.ndarray) -> str:
+    """SHA-1 of an array's dtype, shape and values."""
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha1(f"{arr.dtype.str}{arr.shape}".encode())
+    h.update(memoryview(arr).cast("B"))
+    return h.hexdigest()
+
+
+def index_id(kind: str, path: str) -> IndexId:
+    return kind, os.path.abspath(path)
@@ -1,115 +1,128 @@
-import os
-import json
-from typing import Dict, List, Tuple
-import cv2 as cv
+import logging
+from typing import Any, Dict, List, Optional, Tuple
 import numpy as np
 
+import descriptors
+from indexer import IMAGE_EXTENSIONS, HistogramDictionary, build_store
+from instrumentation import NULL_STATS, QueryStats, instrumented
 
+
+_index = HistogramDictionary("rgb")
 # Global dictionary mapping image filename -> RGB histogram (concatenated vector)
-rgb_dictionary: Dict[str, List[float]] = {}
+rgb_dictionary: Dict[str, List[float]] = _index.by_filename
 # 1-based indexed view: index -> { 'filename': str, 'histogram': List[float] }
-rgb_indexed_dictionary: Dict[int, Dict[str, List[float]]] = {}
+rgb_indexed_dictionary: Dict[int, Dict[str, List[float]]] = _index.by_index
+# Settings used by the last build_rgb_index run; recorded in the binary store
+rgb_build_settings: Dict[str, object] = _index.settings
+# filename -> [size, mtime_ns, sha1 or None] of each indexed file
+rgb_fingerprints: Dict[str, List[Any]] = _index.fingerprints
 
 
 def compute_rgb_histogram(
     image_bgr: np.ndarray, bins: int = 16, normalize: bool = False
 ) -> np.ndarray:
-    
-    if image_bgr is None or image_bgr.size == 0:
-        raise ValueError("Empty image provided to compute_rgb_histogram")
-
-    # Convert to RGB to match naming
-    image_rgb = cv.cvtColor(image_bgr, cv.COLOR_BGR2RGB)
-
-    # Compute histogram per channel
-    hist_r = cv.calcHist([image_rgb], [0], None, [bins], [0, 256])
-    hist_g = cv.calcHist([image_rgb], [1], None, [bins], [0, 256])
-    hist_b = cv.calcHist([image_rgb], [2], None, [bins], [0, 256])
-
-    # Concatenate and convert to 1D float32
-    hist = np.concatenate([hist_r, hist_g, hist_b], axis=0).astype(np.float32).ravel()
-
-    if normalize:
-        # L1 normalize to sum to 1; avoid division by zero
-        s = hist.sum()
-        if s > 0:
-            hist /= s
-
-    return hist
+    """``descriptors.compute_rgb_histogram`` with this module's historical defaults."""
+    return descriptors.compute_rgb_histogram(image_bgr, bins, normalize)
 
 
+@instrumented("rgb_index.build")
 def build_rgb_index(
     images_dir: str = "images",
     bins: int = 256,
     normalize: bool = True,
-    extensions: Tuple[str, ...] = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".avif"),
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    incremental: bool = False,
+    store_path: str = "rgb_dictionary.npy",
+    content_hash: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    stats: QueryStats = NULL_STATS,
 ) -> Dict[str, List[float]]:
-    
-    global rgb_dictionary, rgb_indexed_dictionary
-    rgb_dictionary.clear()
-    rgb_indexed_dictionary.clear()
-
-    if not os.path.isdir(images_dir):
-        print(f"[rgb_index] Directory not found: {images_dir}")
-        return rgb_dictionary
-
-    files = sorted(os.listdir(images_dir))
-    count_ok = 0
-    count_fail = 0
-
-    for fname in files:
-        if not fname.lower().endswith(extensions):
-            continue
-        fpath = os.path.join(images_dir, fname)
-        try:
-            img = cv.imread(fpath)
-            if img is None:
-                raise ValueError(
-                    "cv.imread returned None (unsupported format or unreadable file)"
-                )
-            hist = compute_rgb_histogram(img, bins=bins, normalize=normalize)
-            rgb_dictionary[fname] = hist.tolist()
-            count_ok += 1
-        except Exception as e:
-            print(f"[rgb_index] Skip '{fname}': {e}")
-            count_fail += 1
-
-    # Build stable indexed view (sorted by filename for determinism)
-    for idx, fname in enumerate(sorted(rgb_dictionary.keys()), start=1):
-        rgb_indexed_dictionary[idx] = {
-            "filename": fname,
-            "histogram": rgb_dictionary[fname],
-        }
-
-    print(
-        f"[rgb_index] Indexed {count_ok} image(s), failed {count_fail} in '{images_dir}'."
+    """Index ``images_dir``; ``workers > 1`` (or ``0`` for all CPUs) runs in parallel.
+
+    With ``incremental``, histograms of files unchanged since ``store_path`` was
+    written are reused and only new or modified files are decoded. ``reduce``
+    and ``max_pixels`` set the descriptor resolution (see
+    ``histogram.descriptor_resolution``). Every histogram is kept in memory;
+    large collections should go through ``build_rgb_store`` instead.
+    ``stats`` records the plan, extract and merge stages.
+    """
+    return _index.build(
+        images_dir,
+        bins=bins,
+        normalize=normalize,
+        extensions=extensions,
+        workers=workers,
+        use_processes=use_processes,
+        incremental=incremental,
+        store_path=store_path,
+        content_hash=content_hash,
+        reduce=reduce,
+        max_pixels=max_pixels,
+        stats=stats,
     )
-    return rgb_dictionary
+
+
+def build_rgb_store(
+    images_dir: str = "images",
+    store_path: str = "rgb_dictionary.npy",
+    bins: int = 256,
+    normalize: bool = True,
+    extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+    workers: int = 1,
+    use_processes: bool = False,
+    incremental: bool = False,
+    content_hash: bool = False,
+    reduce: int = 1,
+    max_pixels: Optional[int] = None,
+    resume: bool = True,
+    chunk_rows: int = 1024,
+    stats: Optional[QueryStats] = None,
+) -> int:
+    """Stream the RGB histograms of ``images_dir`` straight into ``store_path``.
+
+    Same options as ``build_rgb_index``, but rows are written in blocks of
+    ``chunk_rows`` as they are computed (see ``indexer.build_index``), so
+    memory stays flat and an interrupted run resumes from its last
+    checkpoint. The module-level dictionaries are left untouched. Returns
+    the number of indexed images.
+    """
+    return build_store(
+        images_dir,
+        "rgb",
+        store_path,
+        bins=bins,
+        normalize=normalize,
+        extensions=extensions,
+        workers=workers,
+        use_processes=use_processes,
+        incremental=incremental,
+        content_hash=content_hash,
+        reduce=reduce,
+        max_pixels=max_pixels,
+        resume=resume,
+        chunk_rows=chunk_rows,
+        stats=stats,
+    )
+
+
+def save_rgb_store(file_path: str = "rgb_dictionary.npy") -> None:
+    """Save the index as a float32 ``.npy`` matrix plus a ``.meta.json`` sidecar.
+
+    After a build that left no image (e.g. all of them were deleted) an empty
+    store is written, so the old rows do not survive.
+    """
+    _index.save_store(file_path)
 
 
 def save_rgb_dictionary_json(file_path: str = "rgb_dictionary.json") -> None:
-    """Save both filename-keyed and indexed dictionaries to a JSON file."""
-    if not rgb_dictionary:
-        print(
-            "[rgb_index] Nothing to save: rgb_dictionary is empty. Build the index first."
-        )
-        return
-    payload = {
-        "by_filename": rgb_dictionary,
-        "by_index": rgb_indexed_dictionary,
-    }
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
-    print(f"[rgb_index] Wrote JSON dictionary to {file_path}")
+    """Export both filename-keyed and indexed dictionaries to a (legacy) JSON file."""
+    _index.save_json(file_path)
 
 
 if __name__ == "__main__":
-    # Quick manual run
-    build_rgb_index("images", bins=256, normalize=True)
-    # Print a tiny sample
-    for i, (k, v) in enumerate(rgb_dictionary.items()):
-        print(f"{i + 1:02d}. {k} -> hist length: {len(v)}")
-        if i >= 2:
-            break
-    # Save outputs for later reuse
-    save_rgb_dictionary_json("rgb_dictionary.json")
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+    # Write the store directly; histograms are never all held in memory
+    build_rgb_store("images", "rgb_dictionary.npy", bins=256, normalize=True)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+
+# The modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def images_dir(tmp_path):
+    """Directory of small solid-color and noise PNGs, one per name."""
+    path = tmp_path / "images"
+    path.mkdir()
+    rng = np.random.default_rng(0)
+    for i, name in enumerate(["a.png", "b.png", "c.png", "d.png", "e.png"]):
+        img = rng.integers(0, 256, size=(16 + i, 12, 3), dtype=np.uint8)
+        img[: 4 + i] = (40 * i, 255 - 40 * i, 128)
+        cv.imwrite(str(path / name), img)
+    return path
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from histogram import (
+    HistogramDatabase,
+    bhattacharyya_distance,
+    chi_square_distance,
+    chi_square_kernel,
+    compute_distances,
+    l2_distance,
+    select_top_k,
+)
+
+SCALAR = {
+    "chi2": chi_square_distance,
+    "l2": l2_distance,
+    "bhattacharyya": bhattacharyya_distance,
+}
+
+
+def _database(rows: int = 50, dim: int = 24, seed: int = 0) -> HistogramDatabase:
+    matrix = np.random.default_rng(seed).random((rows, dim)).astype(np.float32)
+    matrix[3] = 0  # an empty histogram
+    return HistogramDatabase("", [f"{i}.png" for i in range(rows)], matrix)
+
+
+@pytest.mark.parametrize("metric", sorted(SCALAR))
+@pytest.mark.parametrize("normalize", [False, True])
+def test_batch_kernels_match_scalar_distances(metric, normalize):
+    db = _database()
+    q = np.random.default_rng(1).random(24).astype(np.float32)
+    if normalize:
+        q /= q.sum()
+    rows = db.normalized if normalize else db.matrix
+
+    batch = compute_distances(q, db, metric, normalize)
+
+    expected = [SCALAR[metric](q, row) for row in rows]
+    np.testing.assert_allclose(batch, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("metric", sorted(SCALAR))
+def test_batch_kernels_accept_integer_and_list_queries(metric):
+    db = _database()
+    q = np.arange(24, dtype=np.uint8)[::-1].copy()
+
+    expected = compute_distances(q.astype(np.float32), db, metric, False)
+
+    for query in (q, q.tolist()):
+        np.testing.assert_allclose(
+            compute_distances(query, db, metric, False), expected, rtol=1e-5
+        )
+
+
+@pytest.mark.parametrize("metric", sorted(SCALAR))
+def test_scalar_distances_accept_integer_and_list_inputs(metric):
+    p = np.array([0, 3, 250, 7], dtype=np.uint8)
+    q = np.array([5, 0, 10, 7], dtype=np.uint8)
+    expected = SCALAR[metric](p.astype(np.float64), q.astype(np.float64))
+
+    assert SCALAR[metric](p, q) == pytest.approx(expected)
+    assert SCALAR[metric](p.tolist(), q.tolist()) == pytest.approx(expected)
+
+
+def test_chi_square_kernel_scores_integers_in_floating_point():
+    a = np.array([[0, 3, 250, 7], [1, 1, 1, 1]], dtype=np.uint8)
+    b = [5, 0, 10, 7]
+
+    d = chi_square_kernel(a, b)
+
+    assert d.dtype.kind == "f"
+    expected = [
+        chi_square_distance(row.astype(np.float64), np.asarray(b, dtype=np.float64))
+        for row in a
+    ]
+    np.testing.assert_allclose(d, expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize("top_k", [None, 0, 1, 5, 49, 50, 80])
+@pytest.mark.parametrize("max_distance", [None, 0.5, -1.0])
+def test_select_top_k_matches_full_argsort(top_k, max_distance):
+    # Few distinct values, so the k-th distance is usually tied
+    d = np.random.default_rng(2).integers(0, 8, size=50).astype(np.float32) / 8
+
+    order = np.argsort(d, kind="stable")
+    if max_distance is not None:
+        order = order[d[order] <= max_distance]
+    if top_k is not None:
+        order = order[:top_k]
+
+    np.testing.assert_array_equal(select_top_k(d, top_k, max_distance), order)
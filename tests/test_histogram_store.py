@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pytest
+
+from histogram_store import (
+    load_histogram_store,
+    matrix_checksum,
+    save_histogram_store,
+    sidecar_path,
+)
+
+
+def test_round_trip_keeps_float32_rows(tmp_path):
+    path = str(tmp_path / "rgb_dictionary.npy")
+    matrix = np.random.default_rng(1).random((7, 24))
+    save_histogram_store(path, [f"{i}.png" for i in range(7)], matrix, "RGB", 8, True)
+
+    loaded, meta = load_histogram_store(path)
+
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, matrix.astype(np.float32))
+    assert meta["filenames"] == [f"{i}.png" for i in range(7)]
+    assert meta["shape"] == [7, 24]
+    assert (meta["color_space"], meta["bins"], meta["normalize"]) == ("RGB", 8, True)
+    assert meta["checksum"] == matrix_checksum(loaded)
+
+
+def test_empty_store_round_trip(tmp_path):
+    path = str(tmp_path / "rgb_dictionary.npy")
+    save_histogram_store(path, [], np.zeros((0, 24)), "RGB", 8, True)
+
+    loaded, meta = load_histogram_store(path)
+
+    assert loaded.shape == (0, 24)
+    assert meta["filenames"] == []
+
+
+def test_checksum_mismatch_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr("histogram_store.time.sleep", lambda seconds: None)
+    path = str(tmp_path / "rgb_dictionary.npy")
+    matrix = np.ones((3, 6), dtype=np.float32)
+    save_histogram_store(path, ["a", "b", "c"], matrix, "RGB", 2, False)
+    # Same shape, other values: only the checksum can tell them apart
+    np.save(path, matrix * 2)
+
+    with pytest.raises(ValueError, match="does not match its sidecar"):
+        load_histogram_store(path)
+
+
+def test_row_count_mismatch_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr("histogram_store.time.sleep", lambda seconds: None)
+    path = str(tmp_path / "rgb_dictionary.npy")
+    save_histogram_store(path, ["a", "b"], np.ones((2, 6)), "RGB", 2, False)
+    np.save(path, np.ones((3, 6), dtype=np.float32))
+
+    with pytest.raises(ValueError):
+        load_histogram_store(path)
+
+
+def test_store_without_checksum_is_accepted(tmp_path):
+    path = str(tmp_path / "rgb_dictionary.npy")
+    save_histogram_store(path, ["a"], np.ones((1, 6)), "RGB", 2, False)
+    with open(sidecar_path(path), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta["checksum"] = None
+    with open(sidecar_path(path), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    loaded, _ = load_histogram_store(path)
+
+    assert loaded.shape == (1, 6)
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pytest
+
+import indexer
+from histogram_store import load_histogram_store
+from indexer import build_index, last_index_report
+from instrumentation import QueryStats
+
+
+def _build(images_dir, output_dir, **kwargs):
+    stats = QueryStats()
+    results = build_index(
+        str(images_dir),
+        kinds=("rgb", "hsv"),
+        bins=8,
+        output_dir=str(output_dir),
+        stats=stats,
+        **kwargs,
+    )
+    return results, dict(last_index_report), stats.counters
+
+
+def test_incremental_counts(images_dir, tmp_path):
+    out = tmp_path / "stores"
+    out.mkdir()
+    _, counts, _ = _build(images_dir, out, incremental=True)
+    assert counts == {
+        "added": 5,
+        "updated": 0,
+        "removed": 0,
+        "unchanged": 0,
+        "failed": 0,
+    }
+
+    (images_dir / "b.png").unlink()
+    (images_dir / "f.png").write_bytes((images_dir / "a.png").read_bytes())
+    (images_dir / "broken.png").write_bytes(b"not an image")
+    os.utime(images_dir / "c.png", ns=(1, 1))
+    results, counts, counters = _build(images_dir, out, incremental=True)
+
+    assert counts == {
+        "added": 1,
+        "updated": 1,
+        "removed": 1,
+        "unchanged": 3,
+        "failed": 1,
+    }
+    assert counters["images_decoded"] == 2
+    assert counters["rows_reused"] == 3
+    filenames, matrix = results["rgb"]
+    assert filenames == ["a.png", "c.png", "d.png", "e.png", "f.png"]
+    np.testing.assert_array_equal(matrix[0], matrix[4])
+
+
+def test_incremental_run_matches_full_build(images_dir, tmp_path):
+    incremental = tmp_path / "incremental"
+    full = tmp_path / "full"
+    incremental.mkdir()
+    full.mkdir()
+    _build(images_dir, incremental, incremental=True)
+    (images_dir / "a.png").unlink()
+    _build(images_dir, incremental, incremental=True)
+    _build(images_dir, full)
+
+    for kind in ("rgb", "hsv"):
+        matrix, meta = load_histogram_store(str(incremental / f"{kind}_dictionary.npy"))
+        expected, expected_meta = load_histogram_store(
+            str(full / f"{kind}_dictionary.npy")
+        )
+        assert meta["filenames"] == expected_meta["filenames"]
+        np.testing.assert_array_equal(matrix, expected)
+
+
+def test_interrupted_build_resumes_from_last_checkpoint(
+    images_dir, tmp_path, monkeypatch
+):
+    out = tmp_path / "stores"
+    out.mkdir()
+    expected, _, _ = _build(images_dir, tmp_path)
+
+    seen = []
+    extract = indexer.EXTRACTORS["rgb"]
+
+    def interrupted(img, bins, normalize):
+        seen.append(img)
+        if len(seen) == 4:
+            raise KeyboardInterrupt
+        return extract(img, bins, normalize)
+
+    monkeypatch.setitem(indexer.EXTRACTORS, "rgb", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _build(images_dir, out, chunk_rows=2)
+    monkeypatch.setitem(indexer.EXTRACTORS, "rgb", extract)
+
+    results, counts, counters = _build(images_dir, out, chunk_rows=2)
+
+    # Rows 0-1 were checkpointed; row 2 was still buffered when interrupted
+    assert counters["rows_resumed"] == 2
+    assert counters["images_decoded"] == 3
+    assert counts["failed"] == 0
+    for kind in ("rgb", "hsv"):
+        assert results[kind][0] == expected[kind][0]
+        np.testing.assert_array_equal(results[kind][1], expected[kind][1])
+    assert not any(
+        name.endswith((".partial", ".partial.log")) for name in os.listdir(out)
+    )
+
+
+def test_resume_restarts_when_a_checkpointed_image_changed(
+    images_dir, tmp_path, monkeypatch
+):
+    out = tmp_path / "stores"
+    out.mkdir()
+    extract = indexer.EXTRACTORS["rgb"]
+    calls = []
+
+    def interrupted(img, bins, normalize):
+        calls.append(img)
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        return extract(img, bins, normalize)
+
+    monkeypatch.setitem(indexer.EXTRACTORS, "rgb", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _build(images_dir, out, chunk_rows=2)
+    monkeypatch.setitem(indexer.EXTRACTORS, "rgb", extract)
+    os.utime(images_dir / "a.png", ns=(1, 1))
+
+    _, _, counters = _build(images_dir, out, chunk_rows=2)
+
+    assert counters["rows_resumed"] == 0
+    assert counters["images_decoded"] == 5
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from indexer import list_image_files, map_image_files
+from instrumentation import NULL_STATS, QueryStats, instrumented
+
+
+logger = logging.getLogger(__name__)
+
+# Pre-scaled result thumbnails, one PNG per (path, mtime, file size, box).
+# Editing or replacing an image changes its key, so stale entries are never
+# served; they are only left behind until ``ThumbnailCache.clear``.
+DEFAULT_THUMBNAIL_DIR = ".thumbnails"
+THUMBNAIL_SIZE: Tuple[int, int] = (250, 250)
+
+ThumbnailKey = Tuple[str, int, int]
+
+
+def thumbnail_key(full_path: str) -> ThumbnailKey:
+    """``(abspath, mtime_ns, size)`` identifying the current content of a file."""
+    st = os.stat(full_path)
+    return os.path.abspath(full_path), st.st_mtime_ns, st.st_size
+
+
+def make_thumbnail(
+    full_path: str, size: Tuple[int, int] = THUMBNAIL_SIZE
+) -> Image.Image:
+    """Decode ``full_path`` and downscale it to fit ``size``."""
+    img = Image.open(full_path)
+    # JPEG: let the decoder scale down by 1/2..1/8 before resampling
+    img.draft(img.mode, (size[0] * 2, size[1] * 2))
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    return img
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache, safe to share between worker threads."""
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_THUMBNAIL_DIR,
+        size: Tuple[int, int] = THUMBNAIL_SIZE,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cache_path(self, key: ThumbnailKey) -> str:
+        path, mtime_ns, file_size = key
+        digest = hashlib.sha1(
+            f"{path}\0{mtime_ns}\0{file_size}\0{self.size[0]}x{self.size[1]}".encode()
+        ).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".png")
+
+    @instrumented("thumbnails.get")
+    def get(
+        self,
+        full_path: str,
+        key: Optional[ThumbnailKey] = None,
+        stats: QueryStats = NULL_STATS,
+    ) -> Image.Image:
+        """Thumbnail of ``full_path``, built and stored on the first request."""
+        key = key or thumbnail_key(full_path)
+        cached = self.cache_path(key)
+        try:
+            with stats.stage("read"):
+                img = Image.open(cached)
+                img.load()
+        except (OSError, ValueError):
+            pass
+        else:
+            with self._lock:
+                self.hits += 1
+            stats.count("cache_hits")
+            stats.count("bytes_read", os.path.getsize(cached))
+            return img
+        with self._lock:
+            self.misses += 1
+        stats.count("cache_misses")
+        with stats.stage("build"):
+            img = make_thumbnail(full_path, self.size)
+        stats.count("bytes_read", key[2])
+        with stats.stage("store"):
+            self._store(cached, img)
+        return img
+
+    def _store(self, cached: str, img: Image.Image) -> None:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # Unique temp name: two threads may build the same thumbnail at once
+        tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_path, format="PNG")
+            os.replace(tmp_path, cached)
+        except OSError as e:
+            logger.warning("Could not cache thumbnail %s: %s", cached, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def contains(self, full_path: str) -> bool:
+        return os.path.isfile(self.cache_path(thumbnail_key(full_path)))
+
+    def warm(
+        self,
+        images_dir: str,
+        filenames: Optional[List[str]] = None,
+        workers: int = 1,
+    ) -> int:
+        """Build the missing thumbnails of ``filenames``; returns how many were made."""
+        if filenames is None:
+            filenames = list_image_files(images_dir)
+        missing = [
+            f for f in filenames if not self.contains(os.path.join(images_dir, f))
+        ]
+        built = 0
+        for fname, _, error in map_image_files(
+            images_dir, missing, self.get, workers=workers
+        ):
+            if error is not None:
+                logger.warning("No thumbnail for '%s': %s", fname, error)
+            else:
+                built += 1
+        return built
+
+    def clear(self) -> None:
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".png"):
+                    os.remove(os.path.join(root, name))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(module)s] %(message)s")
+    count = ThumbnailCache().warm("images", workers=0)
+    logger.info("Built %d thumbnail(s) in %s", count, DEFAULT_THUMBNAIL_DIR)
@@ -1,7 +1,13 @@
-from index import dictionnaire
+from instrumentation import NULL_STATS, instrumented
+from keyword_store import DEFAULT_KEYWORD_DB, load_keywords
+from query_cache import index_id, result_cache
 import cv2 as cv
+import heapq
+import logging
 import math
 
+logger = logging.getLogger(__name__)
+
 
 def show_image(image):
     cv.imshow('Image', image)
@@ -19,16 +25,12 @@ def evaluate_query(query):
     for i, mot in enumerate(mots):
         evaluation[mot] = round(1.0 * (facteur ** i), 2)
 
-    print("\n" + "_" * 60)
-    print("EVALUATION")
-    print("_" * 60)
-    print(f"Requête: '{query}'")
-    print(f"Méthode: Exp | Facteur: {facteur}")
-    print("_" * 60)
-    for mot, poids in evaluation.items():
-        barre = "█" * int(poids * 20)
-        print(f"  {mot:20s} → {poids:.2f}  {barre}")
-    print("_" * 60 + "\n")
+    if logger.isEnabledFor(logging.DEBUG):
+        lignes = [f"EVALUATION | Requête: '{query}' | Méthode: Exp | Facteur: {facteur}"]
+        for mot, poids in evaluation.items():
+            barre = "█" * int(poids * 20)
+            lignes.append(f"  {mot:20s} → {poids:.2f}  {barre}")
+        logger.debug("\n".join(lignes))
 
     return evaluation
 
@@ -37,9 +39,8 @@ def crop_features_by_query_length(result_images, query, dictionnaire):
     mots = [mot.lower() for mot in query.split() if mot != '+']
     n = len(mots)
 
-    print("\n" + "_" * 60)
-    print(f"Cropping | Nbr mots: {n}")
-    print("_" * 60)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    lignes = [f"Cropping | Nbr mots: {n}"]
 
     cropped_data = {}
 
@@ -53,12 +54,13 @@ def crop_features_by_query_length(result_images, query, dictionnaire):
 
             cropped_data[image] = adjusted_features
 
-            print(f"\n {image}:")
-            for mot, poids in adjusted_features.items():
-                barre = "" * int(poids * 20) if poids > 0 else ""
-                print(f"   {mot:15s} → {poids:.2f}  {barre}")
+            if debug:
+                lignes.append(f" {image}:")
+                for mot, poids in adjusted_features.items():
+                    lignes.append(f"   {mot:15s} → {poids:.2f}")
 
-    print("_" * 60 + "\n")
+    if debug:
+        logger.debug("\n".join(lignes))
     return cropped_data
 
 
@@ -76,34 +78,85 @@ def cosine_similarity(query, image_features):
     return round(dot_product / (norm_query * norm_image), 4)
 
 
-def search_images(recherche):
-    result_images = []
+@instrumented("vectorielle.search")
+def search_images(recherche, top_k=None, min_score=None, keyword_db=DEFAULT_KEYWORD_DB,
+                  explain=False, use_cache=True, stats=NULL_STATS):
+    # top_k: keep only the k best images (partial selection with a heap)
+    # min_score: drop images whose cosine score is below this threshold
+    # explain: also return a dict of per-query diagnostics (weights, cropping, ranking)
+    # use_cache: answer repeated queries from query_cache.result_cache
+    # stats: instrumentation.QueryStats filled with per-stage timings and counters
+    with stats.stage("load"):
+        keywords = load_keywords(keyword_db)
+    cache_index = index_id("keywords", keyword_db)
+    # Case and spacing of the raw query matter to the pre-filter and the crop
+    cache_params = ("vectorielle", recherche, top_k, min_score)
+    if use_cache and not explain:
+        cached = result_cache.get(cache_index, keywords.version, cache_params)
+        if cached is not None:
+            stats.count("cache_hits")
+            return list(cached[0]), dict(cached[1])
+        stats.count("cache_misses")
+
     mot_cle = recherche.split(" ")
     ou = "+" in mot_cle
     mot_cle_set = set(mot for mot in mot_cle if mot != "+")
 
     evaluation = evaluate_query(recherche)
 
-    for elem in dictionnaire:
-        features_set = set(dictionnaire[elem].keys())
-        if (ou and mot_cle_set.intersection(features_set)) or (not ou and mot_cle_set.issubset(features_set)):
-            result_images.append(elem)
-
-    cropped_data = crop_features_by_query_length(result_images, recherche, dictionnaire)
+    # Boolean pre-filter, then one sparse pass over the query's term columns.
+    # Features outside an image's n heaviest count as 0, exactly like
+    # crop_features_by_query_length followed by cosine_similarity.
+    with stats.stage("index"):
+        index = keywords.vector
+    with stats.stage("match"):
+        if ou:
+            candidates = index.inverted.match_any(mot_cle_set)
+        else:
+            candidates = index.inverted.match_all(mot_cle_set)
+    stats.count("rows_scanned",
+                sum(len(index.inverted.postings_for(mot)) for mot in mot_cle_set))
+    n = len([mot for mot in recherche.split() if mot != '+'])
+    with stats.stage("score"):
+        scores = index.cosine_scores(evaluation, n, candidates)
+    stats.count("candidates_scored", len(candidates))
 
     cosine_scores = {}
-    for image, features in cropped_data.items():
-        score = cosine_similarity(evaluation, features)
-        if score > 0:
-            cosine_scores[image] = score
-
-    sorted_images = [img for img, _ in sorted(cosine_scores.items(), key=lambda x: x[1], reverse=True)]
-
-    print("\n" + "_" * 60)
-    print("SIMILARITÉ COSINUS | Classement des images")
-    print("_" * 60)
-    for image, score in sorted(cosine_scores.items(), key=lambda x: x[1], reverse=True):
-        print(f"  {image:40s} → {score:.4f}")
-    print("_" * 60 + "\n")
-
+    for image_id, score in scores.items():
+        if min_score is None or score >= min_score:
+            cosine_scores[index.images[image_id]] = score
+
+    with stats.stage("rank"):
+        if top_k is None:
+            ranking = sorted(cosine_scores.items(), key=lambda x: x[1], reverse=True)
+        else:
+            ranking = heapq.nlargest(max(top_k, 0), cosine_scores.items(),
+                                     key=lambda x: x[1])
+            cosine_scores = dict(ranking)
+    sorted_images = [img for img, _ in ranking]
+
+    if logger.isEnabledFor(logging.DEBUG):
+        lignes = ["SIMILARITÉ COSINUS | Classement des images"]
+        lignes += [f"  {image:40s} → {score:.4f}" for image, score in ranking]
+        logger.debug("\n".join(lignes))
+
+    if explain:
+        candidate_names = index.inverted.names(candidates)
+        details = {
+            "query": recherche,
+            "mode": "or" if ou else "and",
+            "method": "exp",
+            "factor": 0.7,
+            "evaluation": evaluation,
+            "crop": n,
+            "candidates": candidate_names,
+            "cropped_features": crop_features_by_query_length(
+                candidate_names, recherche, keywords.dictionnaire
+            ),
+            "ranking": ranking,
+        }
+        return sorted_images, cosine_scores, details
+    if use_cache:
+        result_cache.put(cache_index, keywords.version, cache_params,
+                         (tuple(sorted_images), dict(cosine_scores)))
     return sorted_images, cosine_scores
\ No newline at end of file